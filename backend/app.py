@@ -1,11 +1,33 @@
+import asyncio
+from contextlib import asynccontextmanager, suppress
+
 from fastapi import FastAPI, Depends
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.routing import APIRoute
 
-from routers import goals, records
+from async_db import async_goals_db
+from exceptions import request_validation_exception_handler
+from logs import RequestLoggingMiddleware
+from metrics import MetricsMiddleware, register_db_gauges
+from profiling import PROFILING, ProfilingMiddleware
+from routers import admin, goals, records
+from tracing import QUERY_TRACING, TracingMiddleware
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await async_goals_db.check_query_plans()
+    checkpoints = asyncio.create_task(async_goals_db.checkpoint_periodically())
+    yield
+    checkpoints.cancel()
+    with suppress(asyncio.CancelledError):
+        await checkpoints
+    async_goals_db.close()
+
 
 # App
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -13,12 +35,25 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[records.NEXT_PAGE_TOKEN_HEADER, "ETag", "Server-Timing"],
 )
+app.add_middleware(RequestLoggingMiddleware)
+app.add_middleware(MetricsMiddleware)
+if QUERY_TRACING:
+    app.add_middleware(TracingMiddleware)
+if PROFILING:
+    app.add_middleware(ProfilingMiddleware)
+
+
+app.add_exception_handler(RequestValidationError, request_validation_exception_handler)
 
 
 # Add the routers to the app
 app.include_router(goals.router)
 app.include_router(records.router)
+app.include_router(admin.router)
+
+register_db_gauges(async_goals_db.db)
 
 
 def use_route_names_as_operation_ids(app: FastAPI):
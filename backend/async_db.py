@@ -0,0 +1,236 @@
+import asyncio
+import contextvars
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+from typing import Callable, Iterator, Optional, TypeVar
+from uuid import UUID
+
+from cache import cached_goals_db
+from db import GoalsDB
+from interfaces import DBInterface
+from models import (
+    Goal,
+    GoalWithRecords,
+    Record,
+    RecordBucket,
+    RecordCreateResult,
+    RecordPage,
+    RecordSeries,
+)
+from write_queue import WRITE_BEHIND, WriteQueue
+
+T = TypeVar("T")
+
+CHECKPOINT_INTERVAL_SECONDS = float(
+    os.getenv("GOALS_DB_CHECKPOINT_INTERVAL", default="60")
+)
+
+
+# Runs the blocking GoalsDB calls on a dedicated executor so the event loop
+# stays free while SQLite works. One worker per pooled connection means a
+# worker never has to wait on the pool.
+class AsyncGoalsDB(DBInterface):
+    def __init__(
+        self,
+        db: GoalsDB,
+        max_workers: Optional[int] = None,
+        write_behind: bool = WRITE_BEHIND,
+    ) -> None:
+        super().__init__()
+        self.db = db
+        self.path = db.path
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers or db.pool.size,
+            thread_name_prefix="goals-db",
+        )
+        self.write_queue = WriteQueue(db) if write_behind else None
+
+    async def run(
+        self,
+        fn: Callable[..., T],
+        *args,
+        **kwargs,
+    ) -> T:
+        loop = asyncio.get_running_loop()
+        # Carry the caller's context vars, such as the request's query trace,
+        # over to the worker thread
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(
+            self.executor, partial(context.run, fn, *args, **kwargs)
+        )
+
+    @property
+    def data_version(self) -> str:
+        return self.db.data_version
+
+    def close(self):
+        if self.write_queue is not None:
+            self.write_queue.close()
+        self.executor.shutdown(wait=True)
+        self.db.close()
+
+    async def checkpoint(self) -> tuple[int, int, int]:
+        return await self.run(self.db.checkpoint)
+
+    # Runs until cancelled, so the WAL is checkpointed even while readers keep
+    # SQLite's own automatic checkpoints from completing
+    async def checkpoint_periodically(
+        self,
+        interval: float = CHECKPOINT_INTERVAL_SECONDS,
+    ):
+        while True:
+            await asyncio.sleep(interval)
+            busy, log_frames, checkpointed_frames = await self.checkpoint()
+            if busy or checkpointed_frames < log_frames:
+                logging.debug(
+                    "Checkpointed %d of %d WAL frames", checkpointed_frames, log_frames
+                )
+
+    async def create_tables(self):
+        await self.run(self.db.create_tables)
+
+    async def check_query_plans(
+        self,
+    ) -> dict[str, list[str]]:
+        return await self.run(self.db.check_query_plans)
+
+    async def create_goal(
+        self,
+        goal: Goal,
+    ):
+        await self.run(self.db.create_goal, goal=goal)
+
+    async def get_goals(
+        self,
+    ) -> list[Goal]:
+        return await self.run(self.db.get_goals)
+
+    async def get_goal(
+        self,
+        goal_id: UUID,
+    ) -> Goal:
+        return await self.run(self.db.get_goal, goal_id=goal_id)
+
+    async def get_goals_with_records(
+        self,
+    ) -> list[GoalWithRecords]:
+        return await self.run(self.db.get_goals_with_records)
+
+    async def update_goal(
+        self,
+        goal: Goal,
+    ) -> Goal:
+        return await self.run(self.db.update_goal, goal=goal)
+
+    async def delete_goal(
+        self,
+        goal_id: UUID,
+    ):
+        await self.run(self.db.delete_goal, goal_id=goal_id)
+
+    async def create_record(
+        self,
+        record: Record,
+    ):
+        if self.write_queue is not None:
+            await asyncio.wrap_future(self.write_queue.submit(record))
+        else:
+            await self.run(self.db.create_record, record=record)
+
+    async def create_records(
+        self,
+        records: list[Record],
+    ) -> list[RecordCreateResult]:
+        return await self.run(self.db.create_records, records=records)
+
+    async def get_records(
+        self,
+        max_points: Optional[int] = None,
+    ) -> list[Record]:
+        return await self.run(self.db.get_records, max_points=max_points)
+
+    async def get_records_page(
+        self,
+        limit: int,
+        page_token: Optional[str] = None,
+        goal_id: Optional[UUID] = None,
+        interval_start_date: Optional[datetime] = None,
+        interval_end_date: Optional[datetime] = None,
+    ) -> RecordPage:
+        return await self.run(
+            self.db.get_records_page,
+            limit=limit,
+            page_token=page_token,
+            goal_id=goal_id,
+            interval_start_date=interval_start_date,
+            interval_end_date=interval_end_date,
+        )
+
+    async def get_records_for_goal(
+        self,
+        goal_id: UUID,
+        interval_start_date: Optional[datetime] = None,
+        interval_end_date: Optional[datetime] = None,
+        max_points: Optional[int] = None,
+    ) -> list[Record]:
+        return await self.run(
+            self.db.get_records_for_goal,
+            goal_id=goal_id,
+            interval_start_date=interval_start_date,
+            interval_end_date=interval_end_date,
+            max_points=max_points,
+        )
+
+    async def get_record_series_for_goal(
+        self,
+        goal_id: UUID,
+        interval_start_date: Optional[datetime] = None,
+        interval_end_date: Optional[datetime] = None,
+        max_points: Optional[int] = None,
+    ) -> RecordSeries:
+        return await self.run(
+            self.db.get_record_series_for_goal,
+            goal_id=goal_id,
+            interval_start_date=interval_start_date,
+            interval_end_date=interval_end_date,
+            max_points=max_points,
+        )
+
+    async def get_record_buckets_for_goal(
+        self,
+        goal_id: UUID,
+        interval_start_date: Optional[datetime] = None,
+        interval_end_date: Optional[datetime] = None,
+    ) -> list[RecordBucket]:
+        return await self.run(
+            self.db.get_record_buckets_for_goal,
+            goal_id=goal_id,
+            interval_start_date=interval_start_date,
+            interval_end_date=interval_end_date,
+        )
+
+    # Left synchronous: the generator does no work until it is iterated,
+    # and streaming responses iterate it off the event loop
+    def iter_records(
+        self,
+        goal_id: Optional[UUID] = None,
+    ) -> Iterator[list]:
+        return self.db.iter_records(goal_id=goal_id)
+
+    async def get_record(
+        self,
+        record_id: UUID,
+    ) -> Record:
+        return await self.run(self.db.get_record, record_id=record_id)
+
+    async def delete_record(
+        self,
+        record_id: UUID,
+    ) -> Optional[UUID]:
+        return await self.run(self.db.delete_record, record_id=record_id)
+
+
+async_goals_db = AsyncGoalsDB(cached_goals_db)
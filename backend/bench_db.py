@@ -0,0 +1,452 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import tempfile
+import time
+from contextlib import closing
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Iterator, Optional
+from uuid import UUID
+
+from dates import datetime_to_timestamp
+from db import INSERT_RECORD, GoalsDB
+from models import Goal, Record
+
+SEED_START = datetime(2023, 1, 1, tzinfo=timezone.utc)
+SEED_DAYS = 365
+SEED_CHUNK_SIZE = 100000
+# Record ids kept while seeding for the single record benchmarks
+SAMPLED_RECORD_IDS = 1000
+# Methods reading every record are skipped above this many records, where
+# they would only measure how long it takes to run out of memory
+FULL_SCAN_LIMIT = 100000
+
+
+def parse_scenario(value: str) -> tuple[int, int]:
+    goals, _, records = value.partition(":")
+    return int(goals), int(records)
+
+
+def make_id(rng: random.Random) -> str:
+    return str(UUID(int=rng.getrandbits(128), version=4))
+
+
+def make_goal_rows(
+    rng: random.Random,
+    count: int,
+) -> list[tuple]:
+    start = datetime_to_timestamp(SEED_START)
+    return [
+        (
+            make_id(rng),
+            f"Goal {index}",
+            start,
+            0.0,
+            100.0,
+            timedelta(days=SEED_DAYS).total_seconds(),
+            timedelta(days=1).total_seconds(),
+            "km",
+            index % 2,
+            start,
+        )
+        for index in range(count)
+    ]
+
+
+def make_record_rows(
+    rng: random.Random,
+    goal_ids: list[str],
+    count: int,
+) -> Iterator[tuple]:
+    start = datetime_to_timestamp(SEED_START)
+    span = timedelta(days=SEED_DAYS) // timedelta(microseconds=1)
+    for _ in range(count):
+        date = start + rng.randrange(span)
+        yield (
+            make_id(rng),
+            rng.choice(goal_ids),
+            date,
+            round(rng.uniform(0.1, 10), 2),
+            date,
+        )
+
+
+# Writes the rows straight through one connection, in large transactions,
+# since going through create_record would take hours at 10M records
+def seed(
+    db: GoalsDB,
+    rng: random.Random,
+    goals: int,
+    records: int,
+) -> tuple[list[str], list[str]]:
+    goal_rows = make_goal_rows(rng, goals)
+    goal_ids = [row[0] for row in goal_rows]
+    record_ids = []
+    step = max(records // SAMPLED_RECORD_IDS, 1)
+
+    with db.pool.connection() as connection:
+        with closing(connection.cursor()) as cursor:
+            cursor.executemany(
+                """
+                INSERT INTO goals(
+                    id,
+                    name,
+                    interval_start_date,
+                    interval_start_amount,
+                    interval_target_amount,
+                    interval_length_seconds,
+                    bucket_size_seconds,
+                    unit,
+                    reset,
+                    created_date
+                ) VALUES(?,?,?,?,?,?,?,?,?,?);
+                """,
+                goal_rows,
+            )
+            connection.commit()
+
+            rows = make_record_rows(rng, goal_ids, records)
+            for offset in range(0, records, SEED_CHUNK_SIZE):
+                chunk = [
+                    next(rows) for _ in range(min(SEED_CHUNK_SIZE, records - offset))
+                ]
+                record_ids.extend(row[0] for row in chunk[::step])
+                cursor.executemany(INSERT_RECORD, chunk)
+                connection.commit()
+
+    db.analyze()
+    db.checkpoint()
+    return goal_ids, record_ids
+
+
+def summarize(seconds: list[float]) -> dict[str, Any]:
+    milliseconds = sorted(value * 1000 for value in seconds)
+    return {
+        "runs": len(milliseconds),
+        "min_ms": milliseconds[0],
+        "median_ms": statistics.median(milliseconds),
+        "mean_ms": statistics.fmean(milliseconds),
+        "p95_ms": milliseconds[
+            min(int(len(milliseconds) * 0.95), len(milliseconds) - 1)
+        ],
+        "max_ms": milliseconds[-1],
+    }
+
+
+# Times one call per set of arguments. With warm_up the first call is made
+# but not timed.
+def time_calls(
+    function: Callable,
+    calls: list[tuple],
+    warm_up: bool = True,
+) -> dict[str, Any]:
+    if warm_up:
+        function(*calls[0])
+        calls = calls[1:]
+    seconds = []
+    for args in calls:
+        start = time.perf_counter()
+        function(*args)
+        seconds.append(time.perf_counter() - start)
+    return summarize(seconds)
+
+
+def make_interval(
+    rng: random.Random,
+    days: int,
+) -> tuple[datetime, datetime]:
+    start = SEED_START + timedelta(days=rng.randrange(SEED_DAYS - days + 1))
+    return start, start + timedelta(days=days)
+
+
+def make_record(
+    rng: random.Random,
+    goal_id: str,
+) -> Record:
+    return Record(
+        goal_id=UUID(goal_id),
+        date=SEED_START + timedelta(seconds=rng.randrange(SEED_DAYS * 86400)),
+        amount=1.0,
+    )
+
+
+# Every GoalsDB method, reads first and the writes that change the data last.
+# Cascading goal deletes come at the very end, each on a different goal.
+def run_benchmarks(
+    db: GoalsDB,
+    rng: random.Random,
+    goal_ids: list[str],
+    record_ids: list[str],
+    records: int,
+    repeat: int,
+) -> dict[str, Any]:
+    # One more than repeat, for the warm-up call
+    runs = repeat + 1
+
+    def goals() -> list[str]:
+        return [rng.choice(goal_ids) for _ in range(runs)]
+
+    results = {}
+
+    def bench(
+        name: str,
+        function: Callable,
+        calls: list[tuple],
+        warm_up: bool = True,
+    ):
+        results[name] = time_calls(function, calls, warm_up)
+        print(
+            f"  {name:<40}{results[name]['median_ms']:>12.3f}"
+            f"{results[name]['p95_ms']:>12.3f}",
+            flush=True,
+        )
+
+    def skip(name: str):
+        results[name] = None
+        print(f"  {name:<40}{'skipped':>12}", flush=True)
+
+    bench("get_goals", db.get_goals, [()] * runs)
+    bench("get_goal", db.get_goal, [(UUID(goal_id),) for goal_id in goals()])
+
+    if records <= FULL_SCAN_LIMIT:
+        bench("get_goals_with_records", db.get_goals_with_records, [()] * runs)
+        bench("get_records", db.get_records, [()] * runs)
+        bench(
+            "get_records(max_points=1000)",
+            db.get_records,
+            [(1000,)] * runs,
+        )
+        bench(
+            "iter_records",
+            lambda: sum(len(chunk) for chunk in db.iter_records()),
+            [()] * runs,
+        )
+    else:
+        for name in (
+            "get_goals_with_records",
+            "get_records",
+            "get_records(max_points=1000)",
+            "iter_records",
+        ):
+            skip(name)
+
+    bench(
+        "get_records_page(limit=1000)",
+        db.get_records_page,
+        [(1000,)] * runs,
+    )
+    bench(
+        "get_records_page(goal, limit=1000)",
+        db.get_records_page,
+        [(1000, None, UUID(goal_id)) for goal_id in goals()],
+    )
+    bench(
+        "get_records_for_goal",
+        db.get_records_for_goal,
+        [(UUID(goal_id),) for goal_id in goals()],
+    )
+    for days in (1, 30):
+        bench(
+            f"get_records_for_goal({days}d)",
+            db.get_records_for_goal,
+            [(UUID(goal_id), *make_interval(rng, days)) for goal_id in goals()],
+        )
+    bench(
+        "get_records_for_goal(max_points=500)",
+        db.get_records_for_goal,
+        [(UUID(goal_id), None, None, 500) for goal_id in goals()],
+    )
+    bench(
+        "get_record_series_for_goal",
+        db.get_record_series_for_goal,
+        [(UUID(goal_id),) for goal_id in goals()],
+    )
+    bench(
+        "get_record_series_for_goal(30d)",
+        db.get_record_series_for_goal,
+        [(UUID(goal_id), *make_interval(rng, 30)) for goal_id in goals()],
+    )
+    bench(
+        "get_record_buckets_for_goal",
+        db.get_record_buckets_for_goal,
+        [(UUID(goal_id),) for goal_id in goals()],
+    )
+    bench(
+        "get_record",
+        db.get_record,
+        [(UUID(rng.choice(record_ids)),) for _ in range(runs)],
+    )
+
+    bench(
+        "create_goal",
+        db.create_goal,
+        [
+            (
+                Goal(
+                    name=f"Created {index}",
+                    interval_start_date=SEED_START,
+                    interval_start_amount=0,
+                    interval_target_amount=100,
+                    interval_length=timedelta(days=SEED_DAYS),
+                    bucket_size=timedelta(days=1),
+                    unit="km",
+                    reset=False,
+                ),
+            )
+            for index in range(runs)
+        ],
+    )
+    bench(
+        "update_goal",
+        db.update_goal,
+        [
+            (db.get_goal(UUID(goal_id)).model_copy(update={"name": "Updated"}),)
+            for goal_id in goals()
+        ],
+    )
+    bench(
+        "create_record",
+        db.create_record,
+        [(make_record(rng, goal_id),) for goal_id in goals()],
+    )
+    bench(
+        "create_records(1000)",
+        db.create_records,
+        [
+            ([make_record(rng, rng.choice(goal_ids)) for _ in range(1000)],)
+            for _ in range(runs)
+        ],
+    )
+    bench(
+        "delete_record",
+        db.delete_record,
+        [
+            (UUID(record_id),)
+            for record_id in rng.sample(record_ids, min(repeat, len(record_ids)))
+        ],
+        warm_up=False,
+    )
+    bench(
+        "delete_goal",
+        db.delete_goal,
+        [
+            (UUID(goal_id),)
+            for goal_id in rng.sample(goal_ids, min(repeat, len(goal_ids)))
+        ],
+        warm_up=False,
+    )
+    return results
+
+
+def get_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(
+    baseline: dict[str, Any],
+    current: dict[str, Any],
+):
+    baseline_scenarios = {
+        (scenario["goals"], scenario["records"]): scenario["results"]
+        for scenario in baseline["scenarios"]
+    }
+    print(f"\nCompared with {baseline.get('commit') or 'baseline'} (median ms)")
+    for scenario in current["scenarios"]:
+        previous = baseline_scenarios.get((scenario["goals"], scenario["records"]))
+        if previous is None:
+            continue
+        print(f"{scenario['goals']} goals, {scenario['records']} records")
+        for name, result in scenario["results"].items():
+            before = previous.get(name)
+            if result is None or before is None:
+                continue
+            print(
+                f"  {name:<40}{before['median_ms']:>12.3f}{result['median_ms']:>12.3f}"
+                f"{result['median_ms'] / before['median_ms']:>8.2f}x"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="GoalsDB benchmark")
+    parser.add_argument(
+        "--scenarios",
+        type=parse_scenario,
+        nargs="+",
+        default=[(10, 1000), (1000, 100000), (10000, 1000000)],
+        metavar="GOALS:RECORDS",
+        help="database sizes to seed, e.g. 10000:10000000",
+    )
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--output",
+        help="where to write the results, by default bench/db-<commit>.json",
+    )
+    parser.add_argument("--compare", help="results of an earlier run to compare with")
+    args = parser.parse_args()
+
+    commit = get_commit()
+    report = {
+        "commit": commit,
+        "date": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "seed": args.seed,
+        "repeat": args.repeat,
+        "scenarios": [],
+    }
+
+    for goals, records in args.scenarios:
+        # Every scenario gets a fresh database seeded from the same seed, so
+        # runs on different commits benchmark identical data
+        rng = random.Random(f"{args.seed}:{goals}:{records}")
+        with tempfile.TemporaryDirectory() as directory:
+            db = GoalsDB(os.path.join(directory, "bench.db"))
+            try:
+                print(f"{goals} goals, {records} records", flush=True)
+                start = time.perf_counter()
+                goal_ids, record_ids = seed(db, rng, goals, records)
+                seed_seconds = time.perf_counter() - start
+                print(
+                    f"  seeded in {seed_seconds:.1f}s\n"
+                    f"  {'method':<40}{'median ms':>12}{'p95 ms':>12}",
+                    flush=True,
+                )
+                results = run_benchmarks(
+                    db, rng, goal_ids, record_ids, records, args.repeat
+                )
+            finally:
+                db.close()
+
+        report["scenarios"].append(
+            {
+                "goals": goals,
+                "records": records,
+                "seed_seconds": seed_seconds,
+                "results": results,
+            }
+        )
+
+    output = args.output or os.path.join("bench", f"db-{(commit or 'local')[:12]}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"\nWrote {output}")
+
+    if args.compare:
+        with open(args.compare) as file:
+            compare(json.load(file), report)
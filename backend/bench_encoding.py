@@ -0,0 +1,124 @@
+import argparse
+import json
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable
+from uuid import uuid4
+
+from encoding import ENCODINGS, get_adapter
+from fastapi.encoders import jsonable_encoder
+from models import Goal, Record, RecordSeries
+
+
+def make_goals(count: int) -> list[Goal]:
+    start = datetime(2023, 1, 1, tzinfo=timezone.utc)
+    return [
+        Goal(
+            name=f"Goal {index}",
+            interval_start_date=start,
+            interval_start_amount=0,
+            interval_target_amount=100,
+            interval_length=timedelta(days=30),
+            bucket_size=timedelta(days=1),
+            unit="km",
+            reset=False,
+            progress=index,
+            goal_progress=index / 2,
+            goal_progress_rate=100 / timedelta(days=30).total_seconds(),
+        )
+        for index in range(count)
+    ]
+
+
+def make_records(count: int) -> list[Record]:
+    goal_id = uuid4()
+    start = datetime(2023, 1, 1, tzinfo=timezone.utc)
+    return [
+        Record(
+            goal_id=goal_id,
+            date=start + timedelta(minutes=index),
+            amount=1.5,
+            progress=1.5 * (index + 1),
+        )
+        for index in range(count)
+    ]
+
+
+def make_series(records: list[Record]) -> RecordSeries:
+    return RecordSeries(
+        goal_id=records[0].goal_id,
+        dates=[int(record.date.timestamp() * 1000) for record in records],
+        amounts=[record.amount for record in records],
+        progress=[record.progress for record in records],
+    )
+
+
+# What FastAPI does with a route's return value: validate it against the
+# response model, serialize it, run it through jsonable_encoder and dump it
+# with the standard library
+def encode_default(content_type: Any) -> Callable[[Any], bytes]:
+    adapter = get_adapter(content_type)
+
+    def encode(content: Any) -> bytes:
+        value = adapter.validate_python(content)
+        value = adapter.dump_python(value, mode="json")
+        return json.dumps(
+            jsonable_encoder(value),
+            ensure_ascii=False,
+            allow_nan=False,
+            indent=None,
+            separators=(",", ":"),
+        ).encode("utf-8")
+
+    return encode
+
+
+def time_encode(
+    encode: Callable[[Any], bytes],
+    content: Any,
+    repeat: int,
+) -> tuple[float, int]:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = encode(content)
+        best = min(best, time.perf_counter() - start)
+    return best, len(body)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Response encoding benchmark")
+    parser.add_argument("--goals", type=int, default=1000)
+    parser.add_argument("--records", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    records = make_records(args.records)
+    payloads = [
+        ("list[Goal]", list[Goal], make_goals(args.goals)),
+        ("list[Record]", list[Record], records),
+        ("RecordSeries", RecordSeries, make_series(records)),
+    ]
+
+    print(f"{'payload':<14}{'encoding':<22}{'best ms':>10}{'bytes':>12}{'speedup':>9}")
+    for name, content_type, content in payloads:
+        default_encode = encode_default(content_type)
+        baseline, size = time_encode(default_encode, content, args.repeat)
+        print(f"{name:<14}{'fastapi default':<22}{baseline * 1000:>10.1f}{size:>12}")
+
+        adapter = get_adapter(content_type)
+        for encoding in ENCODINGS:
+            seconds, size = time_encode(
+                lambda content: encoding.encode_model(adapter, content),
+                content,
+                args.repeat,
+            )
+            print(
+                f"{name:<14}{encoding.media_type:<22}{seconds * 1000:>10.1f}"
+                f"{size:>12}{baseline / seconds:>8.1f}x"
+            )
+
+        # The fast path must not change what JSON clients receive
+        assert json.loads(default_encode(content)) == json.loads(
+            ENCODINGS[0].encode_model(adapter, content)
+        )
@@ -0,0 +1,126 @@
+import argparse
+import time
+import warnings
+from datetime import datetime, timedelta, timezone
+from typing import Callable
+from uuid import UUID, uuid4
+
+from dates import datetime_to_timestamp, timestamp_to_datetime
+from db import read_goal, read_record
+from models import Goal, Record
+
+
+def make_record_rows(count: int) -> list[tuple]:
+    goal_id = str(uuid4())
+    start = datetime_to_timestamp(datetime(2023, 1, 1, tzinfo=timezone.utc))
+    return [
+        (
+            str(uuid4()),
+            goal_id,
+            start + index * 60_000_000,
+            1.5,
+            start + index * 60_000_000 + 1,
+            1.5 * (index + 1),
+        )
+        for index in range(count)
+    ]
+
+
+def make_goal_rows(count: int) -> list[tuple]:
+    start = datetime_to_timestamp(datetime(2023, 1, 1, tzinfo=timezone.utc))
+    return [
+        (
+            str(uuid4()),
+            f"Goal {index}",
+            start,
+            0.0,
+            100.0,
+            timedelta(days=30).total_seconds(),
+            timedelta(days=1).total_seconds(),
+            "km",
+            0,
+            start,
+            float(index),
+        )
+        for index in range(count)
+    ]
+
+
+# read_record and read_goal as they were, building the models through full
+# validation
+def read_record_validated(row) -> Record:
+    return Record(
+        id=UUID(row[0]),
+        goal_id=UUID(row[1]),
+        date=timestamp_to_datetime(row[2]),
+        amount=row[3],
+        created_date=timestamp_to_datetime(row[4]),
+        progress=row[5] if row[5] is not None else 0,
+    )
+
+
+def read_goal_validated(row) -> Goal:
+    interval_length = timedelta(seconds=row[5])
+    return Goal(
+        id=UUID(row[0]),
+        name=str(row[1]),
+        interval_start_date=timestamp_to_datetime(row[2]),
+        interval_start_amount=row[3],
+        interval_target_amount=row[4],
+        interval_length=interval_length,
+        bucket_size=timedelta(seconds=row[6]),
+        unit=str(row[7]),
+        reset=bool(row[8]),
+        created_date=timestamp_to_datetime(row[9]),
+        progress=row[3] + row[10],
+        goal_progress_rate=(row[4] - row[3]) / interval_length.total_seconds(),
+    )
+
+
+def time_read(
+    read: Callable,
+    rows: list[tuple],
+    repeat: int,
+) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for row in rows:
+            read(row)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Row hydration benchmark")
+    parser.add_argument("--records", type=int, default=100000)
+    parser.add_argument("--goals", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    readers = [
+        ("Record", make_record_rows(args.records), read_record_validated, read_record),
+        ("Goal", make_goal_rows(args.goals), read_goal_validated, read_goal),
+    ]
+
+    print(
+        f"{'model':<8}{'rows':>8}{'validated us/row':>18}{'trusted us/row':>16}{'speedup':>9}"
+    )
+    for name, rows, read_validated, read_trusted in readers:
+        # Both paths must produce the same models, and the trusted ones must
+        # serialize without pydantic warning about unexpected types
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            for row in rows[:1000]:
+                trusted = read_trusted(row)
+                assert trusted.model_dump() == read_validated(row).model_dump()
+                trusted.model_dump_json()
+
+        validated = time_read(read_validated, rows, args.repeat)
+        trusted = time_read(read_trusted, rows, args.repeat)
+        print(
+            f"{name:<8}{len(rows):>8}"
+            f"{validated / len(rows) * 1e6:>18.2f}"
+            f"{trusted / len(rows) * 1e6:>16.2f}"
+            f"{validated / trusted:>8.1f}x"
+        )
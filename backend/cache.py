@@ -0,0 +1,163 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Generic, Hashable, Optional, TypeVar
+from uuid import UUID
+
+from db import GoalsDB
+from models import Goal
+from pool import POOL_SIZE
+
+T = TypeVar("T")
+
+CACHE_MAX_ENTRIES = int(os.getenv("GOALS_CACHE_MAX_ENTRIES", default="1024"))
+# Writes through this process invalidate entries as they happen, the TTL only
+# bounds how long writes from elsewhere can go unnoticed
+CACHE_TTL_SECONDS = float(os.getenv("GOALS_CACHE_TTL_SECONDS", default="60"))
+
+_MISSING = object()
+
+
+# A thread safe mapping that forgets entries after ttl seconds and evicts the
+# least recently used one once it holds max_entries.
+#
+# Every invalidation bumps the generation. A reader takes the generation
+# before going to the database and only stores its result if no write
+# invalidated the cache in the meantime, so a slow read can never put back
+# a value a write has just removed.
+class TTLCache(Generic[T]):
+    def __init__(
+        self,
+        max_entries: int = CACHE_MAX_ENTRIES,
+        ttl: float = CACHE_TTL_SECONDS,
+    ) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+        self._entries: OrderedDict[Hashable, tuple[float, T]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    @property
+    def hits(self) -> int:
+        return self._hits
+
+    @property
+    def misses(self) -> int:
+        return self._misses
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(
+        self,
+        key: Hashable,
+        default=None,
+    ):
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is not _MISSING:
+                expires, value = entry
+                if expires > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    return value
+                del self._entries[key]
+
+            self._misses += 1
+            return default
+
+    def set(
+        self,
+        key: Hashable,
+        value: T,
+        generation: Optional[int] = None,
+    ):
+        if self.max_entries < 1:
+            return
+
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(
+        self,
+        *keys: Hashable,
+    ):
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+
+GOALS_KEY = "goals"
+
+
+# Serves get_goal and get_goals from a TTLCache and drops exactly the entries
+# each write can change: the goal itself and the list of all goals, whose
+# progress includes every record
+class CachedGoalsDB(GoalsDB):
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        pool_size: int = POOL_SIZE,
+        cache: Optional[TTLCache] = None,
+    ) -> None:
+        self.cache = TTLCache() if cache is None else cache
+        super().__init__(path=path, pool_size=pool_size)
+
+    def invalidate_goals(
+        self,
+        *goal_ids: UUID,
+    ):
+        self.cache.invalidate(GOALS_KEY, *goal_ids)
+
+    def get_goals(
+        self,
+    ) -> list[Goal]:
+        goals = self.cache.get(GOALS_KEY)
+        if goals is None:
+            generation = self.cache.generation
+            goals = super().get_goals()
+            self.cache.set(GOALS_KEY, goals, generation=generation)
+        return list(goals)
+
+    def get_goal(
+        self,
+        goal_id: UUID,
+    ) -> Goal:
+        goal = self.cache.get(goal_id)
+        if goal is None:
+            generation = self.cache.generation
+            goal = super().get_goal(goal_id)
+            self.cache.set(goal_id, goal, generation=generation)
+        return goal
+
+    # Drops the entries before the data version moves on, so no request can
+    # pair the new version with a cached body from before the write
+    def committed(
+        self,
+        *goal_ids: UUID,
+    ):
+        self.invalidate_goals(*goal_ids)
+        super().committed(*goal_ids)
+
+
+cached_goals_db = CachedGoalsDB()
@@ -1,4 +1,7 @@
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
 
 
 def datetime_now() -> datetime:
@@ -7,3 +10,14 @@ def datetime_now() -> datetime:
 
 def get_timezone_aware_date(date: datetime) -> datetime:
     return date.replace(tzinfo=timezone.utc)
+
+
+# Dates are stored as integer microseconds since the Unix epoch in UTC
+def datetime_to_timestamp(date: datetime) -> int:
+    if date.tzinfo is None:
+        date = get_timezone_aware_date(date)
+    return (date - EPOCH) // MICROSECOND
+
+
+def timestamp_to_datetime(timestamp: int) -> datetime:
+    return EPOCH + timedelta(microseconds=timestamp)
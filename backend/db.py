@@ -1,17 +1,59 @@
+import base64
+import json
+import logging
+import math
+import os
 import sqlite3
+import threading
 from contextlib import closing
-from datetime import datetime, timedelta, timezone
-from typing import Optional
-from uuid import UUID
-
-from dates import datetime_now
-from exceptions import ResourceNotFoundException
+from itertools import groupby
+from operator import itemgetter
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Iterator, Optional, TypeVar
+from uuid import UUID, uuid4
+
+from dates import (
+    MICROSECOND,
+    datetime_now,
+    datetime_to_timestamp,
+    get_timezone_aware_date,
+    timestamp_to_datetime,
+)
+from downsample import lttb
+from exceptions import InvalidRequestException, ResourceNotFoundException
 from interfaces import DBInterface
-from models import Goal, Record
-
-
-def read_date(date_str: str) -> datetime:
-    return datetime.strptime(date_str, "%Y-%m-%d %H:%M:%S").astimezone(timezone.utc)
+from metrics import instrument_methods
+from migrations import migrate
+from models import (
+    Goal,
+    GoalWithRecords,
+    Record,
+    RecordBucket,
+    RecordCreateResult,
+    RecordPage,
+    RecordSeries,
+)
+from pool import POOL_SIZE, ConnectionPool
+from pydantic import BaseModel
+from tracing import QUERY_TRACING, TracingConnection
+
+M = TypeVar("M", bound=BaseModel)
+
+PAGE_SIZE = int(os.getenv("GOALS_DB_PAGE_SIZE", default="1000"))
+EXPORT_CHUNK_SIZE = int(os.getenv("GOALS_DB_EXPORT_CHUNK_SIZE", default="1000"))
+GOAL_PROGRESS_RESOLUTION_SECONDS = int(
+    os.getenv("GOALS_PROGRESS_RESOLUTION_SECONDS", default="60")
+)
+
+
+# Amount per second the target line climbs from the interval's start amount
+def get_goal_progress_rate(
+    start_amount: float,
+    end_amount: float,
+    interval_length: timedelta,
+) -> float:
+    return (end_amount - start_amount) / interval_length.total_seconds()
 
 
 def get_goal_progress(
@@ -25,6 +67,63 @@ def get_goal_progress(
     return start_amount + percentage * (end_amount - start_amount)
 
 
+# The time goal_progress is evaluated at when none is asked for. It only moves
+# once per resolution, so goals served in between are identical and clients
+# can revalidate them.
+def get_progress_time() -> datetime:
+    now = datetime_to_timestamp(datetime_now())
+    return timestamp_to_datetime(
+        now - now % (GOAL_PROGRESS_RESOLUTION_SECONDS * 10**6)
+    )
+
+
+# Goals are read without goal_progress, which depends on the time it is
+# evaluated at, so that they can be cached; it is filled in on the way out
+def with_goal_progress(
+    goal: Goal,
+    as_of: Optional[datetime] = None,
+) -> Goal:
+    if as_of is None:
+        as_of = get_progress_time()
+    elif as_of.tzinfo is None:
+        as_of = get_timezone_aware_date(as_of)
+
+    return goal.model_copy(
+        update={
+            "goal_progress": get_goal_progress(
+                start_amount=goal.interval_start_amount,
+                end_amount=goal.interval_target_amount,
+                start_time=goal.interval_start_date,
+                interval_length=goal.interval_length,
+                current_time=as_of,
+            ),
+        }
+    )
+
+
+# The read_* helpers hydrate trusted rows from our own database. The values
+# already have the types the models hold and dates are timezone aware, so the
+# models are built without validation or validators.
+#
+# For the models read by the row, hydrate goes further than model_construct
+# and sets the instance state directly: every field must be given, defaults
+# included.
+def hydrate(
+    model: type[M],
+    fields: dict,
+) -> M:
+    instance = model.__new__(model)
+    object.__setattr__(instance, "__dict__", fields)
+    object.__setattr__(instance, "__pydantic_fields_set__", set(fields))
+    object.__setattr__(instance, "__pydantic_extra__", None)
+    object.__setattr__(instance, "__pydantic_private__", None)
+    return instance
+
+
+# A goal's records all repeat its id
+read_goal_id = lru_cache(maxsize=1024)(UUID)
+
+
 def read_goal(row) -> Goal:
     id = UUID(row[0])
     name = str(row[1])
@@ -32,117 +131,577 @@ def read_goal(row) -> Goal:
     interval_start_amount = row[3]
     interval_target_amount = row[4]
 
-    interval_start_date = read_date(row[2])
-    interval_length = timedelta(seconds=float(row[5]))
+    interval_start_date = timestamp_to_datetime(row[2])
+    interval_length = timedelta(seconds=row[5])
 
-    bucket_size = timedelta(seconds=float(row[6]))
+    bucket_size = timedelta(seconds=row[6])
     unit = str(row[7])
     reset = bool(row[8])
 
-    created_date = read_date(row[9])
+    created_date = timestamp_to_datetime(row[9])
 
     progress = interval_start_amount
     if row[10] is not None:
         progress += row[10]
 
-    goal_progress = get_goal_progress(
+    goal_progress_rate = get_goal_progress_rate(
         start_amount=interval_start_amount,
         end_amount=interval_target_amount,
-        start_time=interval_start_date,
         interval_length=interval_length,
-        current_time=datetime_now(),
     )
 
-    return Goal(
-        id=id,
-        name=name,
-        interval_start_date=interval_start_date,
-        interval_start_amount=interval_start_amount,
-        interval_target_amount=interval_target_amount,
-        interval_length=interval_length,
-        bucket_size=bucket_size,
-        unit=unit,
-        reset=reset,
-        created_date=created_date,
-        progress=progress,
-        goal_progress=goal_progress,
+    return hydrate(
+        Goal,
+        {
+            "id": id,
+            "name": name,
+            "interval_start_date": interval_start_date,
+            "interval_start_amount": interval_start_amount,
+            "interval_target_amount": interval_target_amount,
+            "interval_length": interval_length,
+            "bucket_size": bucket_size,
+            "unit": unit,
+            "reset": reset,
+            "created_date": created_date,
+            "progress": progress,
+            "goal_progress": None,
+            "goal_progress_rate": goal_progress_rate,
+        },
     )
 
 
-def read_record(row) -> Record:
+# offset is added to the progress in the row, for pages whose progress
+# window starts after the goal's first record
+def read_record(
+    row,
+    offset: float = 0.0,
+) -> Record:
     id = UUID(row[0])
-    goal_id = UUID(row[1])
-    date = read_date(row[2])
-    amount = float(row[3])
-    created_date = read_date(row[4])
-    progress = float(row[5]) if row[5] is not None else 0
-
-    return Record(
-        id=id,
+    goal_id = read_goal_id(row[1])
+    date = timestamp_to_datetime(row[2])
+    amount = row[3]
+    created_date = timestamp_to_datetime(row[4])
+    progress = (row[5] if row[5] is not None else 0.0) + offset
+
+    return hydrate(
+        Record,
+        {
+            "id": id,
+            "goal_id": goal_id,
+            "date": date,
+            "amount": amount,
+            "created_date": created_date,
+            "progress": progress,
+        },
+    )
+
+
+# Parallel columns straight from (date, amount, progress) rows
+def read_record_series(
+    goal_id: UUID,
+    rows: list[tuple],
+) -> RecordSeries:
+    dates, amounts, progress = zip(*rows) if rows else ((), (), ())
+    return RecordSeries.model_construct(
         goal_id=goal_id,
-        date=date,
-        amount=amount,
-        created_date=created_date,
-        progress=progress,
+        dates=[date // 1000 for date in dates],
+        amounts=list(amounts),
+        progress=list(progress),
     )
 
 
+def record_args(record: Record) -> list:
+    return [
+        str(record.id),
+        str(record.goal_id),
+        datetime_to_timestamp(record.date),
+        record.amount,
+        datetime_to_timestamp(record.created_date),
+    ]
+
+
+# Inserts the rows of a bulk create in one go, falling back to a savepoint
+# per row only if that fails, so a row the database refuses is left out
+# instead of failing the rest. Returns the error for each row left out, by
+# the index it was given with.
+def insert_records(
+    cursor: sqlite3.Cursor,
+    inserts: list[tuple[int, list]],
+) -> dict[int, sqlite3.Error]:
+    cursor.execute("SAVEPOINT insert_records;")
+    try:
+        cursor.executemany(
+            INSERT_RECORD,
+            [args for _, args in inserts],
+        )
+        cursor.execute("RELEASE insert_records;")
+        return {}
+    except sqlite3.Error:
+        cursor.execute("ROLLBACK TO insert_records;")
+        cursor.execute("RELEASE insert_records;")
+
+    errors = {}
+    for index, args in inserts:
+        cursor.execute("SAVEPOINT insert_record;")
+        try:
+            cursor.execute(
+                INSERT_RECORD,
+                args,
+            )
+        except sqlite3.Error as error:
+            cursor.execute("ROLLBACK TO insert_record;")
+            errors[index] = error
+        cursor.execute("RELEASE insert_record;")
+    return errors
+
+
+def goal_args(goal: Goal) -> list:
+    return [
+        goal.name,
+        datetime_to_timestamp(goal.interval_start_date),
+        goal.interval_start_amount,
+        goal.interval_target_amount,
+        goal.interval_length.total_seconds(),
+        goal.bucket_size.total_seconds(),
+        goal.unit,
+        goal.reset,
+        datetime_to_timestamp(goal.created_date),
+    ]
+
+
+def goal_interval_filter(
+    goal_id: UUID,
+    interval_start_date: Optional[datetime] = None,
+    interval_end_date: Optional[datetime] = None,
+) -> tuple[str, list]:
+    where_clause = "goal_id=?"
+    args: list = [
+        str(goal_id),
+    ]
+
+    if interval_start_date is not None:
+        where_clause += " AND date>=?"
+        args.append(datetime_to_timestamp(interval_start_date))
+
+    if interval_end_date is not None:
+        where_clause += " AND date<=?"
+        args.append(datetime_to_timestamp(interval_end_date))
+
+    return where_clause, args
+
+
+def downsample_records(
+    records: list[Record],
+    max_points: int,
+) -> list[Record]:
+    records_by_goal: dict[UUID, list[Record]] = {}
+    for record in records:
+        records_by_goal.setdefault(record.goal_id, []).append(record)
+
+    if len(records_by_goal) <= 1:
+        return lttb(
+            records,
+            max_points,
+            x=lambda record: record.date.timestamp(),
+            y=lambda record: record.progress,
+        )
+
+    return sorted(
+        (
+            record
+            for goal_records in records_by_goal.values()
+            for record in downsample_records(goal_records, max_points)
+        ),
+        key=lambda record: (record.date, record.created_date),
+    )
+
+
+def encode_page_token(
+    key: list,
+    progress: Optional[float] = None,
+) -> str:
+    token = {"key": key} if progress is None else {"key": key, "progress": progress}
+    return base64.urlsafe_b64encode(
+        json.dumps(token, separators=(",", ":")).encode()
+    ).decode()
+
+
+def is_number(value) -> bool:
+    return (
+        isinstance(value, (int, float))
+        and not isinstance(value, bool)
+        and math.isfinite(value)
+    )
+
+
+# The (date, created_date, id) key of the last record of the previous page,
+# and for pages of one goal, that goal's progress at the same record
+def decode_page_token(page_token: str) -> tuple[list, Optional[float]]:
+    try:
+        token = json.loads(base64.urlsafe_b64decode(page_token.encode()))
+        key = token["key"]
+        progress = token.get("progress")
+    except (ValueError, TypeError, KeyError, AttributeError):
+        raise InvalidRequestException(message="Invalid page token")
+
+    if not (
+        isinstance(key, list)
+        and len(key) == 3
+        and all(type(value) is int for value in key[:2])
+        and isinstance(key[2], str)
+        and (progress is None or is_number(progress))
+    ):
+        raise InvalidRequestException(message="Invalid page token")
+    return key, progress
+
+
+def read_record_bucket(
+    row,
+    origin: int,
+    width: int,
+) -> RecordBucket:
+    return RecordBucket.model_construct(
+        start_date=timestamp_to_datetime(origin + row[0] * width),
+        end_date=timestamp_to_datetime(origin + (row[0] + 1) * width),
+        amount=row[1],
+        count=row[2],
+        progress=row[3],
+    )
+
+
+def read_goal_with_records(rows) -> GoalWithRecords:
+    return GoalWithRecords.model_construct(
+        goal=read_goal(rows[0][:11]),
+        records=[read_record(row[11:]) for row in rows if row[11] is not None],
+    )
+
+
+SELECT_GOALS = """
+    SELECT
+        goals.id,
+        goals.name,
+        goals.interval_start_date,
+        goals.interval_start_amount,
+        goals.interval_target_amount,
+        goals.interval_length_seconds,
+        goals.bucket_size_seconds,
+        goals.unit,
+        goals.reset,
+        goals.created_date,
+        goals.records_amount as progress
+    FROM
+        goals
+    {where_clause}
+    ORDER BY
+        interval_start_date,
+        created_date
+    ;
+"""
+
+SELECT_RECORDS = """
+    SELECT
+        id,
+        goal_id,
+        date,
+        amount,
+        created_date,
+        SUM (amount) OVER (
+            PARTITION BY goal_id ORDER BY date, created_date, id
+        ) as progress
+    FROM
+        records
+    {where_clause}
+    ORDER BY
+        date,
+        created_date,
+        id
+    ;
+"""
+
+# Only what a chart needs from SELECT_RECORDS, read from the covering index
+SELECT_RECORD_SERIES = """
+    SELECT
+        date,
+        amount,
+        SUM (amount) OVER (
+            PARTITION BY goal_id ORDER BY date, created_date, id
+        ) as progress
+    FROM
+        records
+    {where_clause}
+    ORDER BY
+        date,
+        created_date,
+        id
+    ;
+"""
+
+# One page of records after a (date, created_date, id) key. The limit is
+# applied before the progress window so a page only ever reads its own rows;
+# progress is relative to the page and offset by the progress carried in the
+# page token, or by SELECT_RECORD_OFFSETS.
+SELECT_RECORDS_PAGE = """
+    SELECT
+        id,
+        goal_id,
+        date,
+        amount,
+        created_date,
+        SUM (amount) OVER (
+            PARTITION BY goal_id ORDER BY date, created_date, id
+        ) as progress
+    FROM (
+        SELECT
+            id,
+            goal_id,
+            date,
+            amount,
+            created_date
+        FROM
+            records
+        {where_clause}
+        ORDER BY
+            date,
+            created_date,
+            id
+        LIMIT :limit
+    )
+    ORDER BY
+        date,
+        created_date,
+        id
+    ;
+"""
+
+# What the records before a page add to the progress of each goal on it, for
+# pages across goals, whose tokens cannot carry a total for every goal. It
+# reads every earlier record of those goals from the covering index, so its
+# cost grows with the depth of the page; pages of one goal carry the goal's
+# progress in their token instead.
+SELECT_RECORD_OFFSETS = """
+    SELECT
+        goal_id,
+        SUM (amount)
+    FROM
+        records
+    WHERE
+        goal_id IN (SELECT value FROM json_each(:goal_ids))
+        AND (date, created_date, id) <= (:date, :created_date, :id)
+        {conditions}
+    GROUP BY
+        goal_id
+    ;
+"""
+
+# Every goal joined to its records in goal order, so each goal's rows are
+# contiguous. The first 11 columns are a goal row, the rest a record row.
+SELECT_GOALS_WITH_RECORDS = """
+    SELECT
+        goals.id,
+        goals.name,
+        goals.interval_start_date,
+        goals.interval_start_amount,
+        goals.interval_target_amount,
+        goals.interval_length_seconds,
+        goals.bucket_size_seconds,
+        goals.unit,
+        goals.reset,
+        goals.created_date,
+        goals.records_amount as progress,
+        records.id,
+        records.goal_id,
+        records.date,
+        records.amount,
+        records.created_date,
+        SUM(records.amount) OVER (
+            PARTITION BY goals.id
+            ORDER BY records.date, records.created_date, records.id
+        ) as record_progress
+    FROM
+        goals
+    LEFT OUTER JOIN
+        records ON goals.id = records.goal_id
+    ORDER BY
+        goals.interval_start_date,
+        goals.created_date,
+        goals.id,
+        records.date,
+        records.created_date,
+        records.id
+    ;
+"""
+
+# Sums a goal's records into fixed windows of :width microseconds counted
+# from :origin. Buckets are numbered by floor dividing each record's offset
+# (integer division truncates, so negative offsets are stepped down), and
+# progress is the running total over all buckets, so it stays correct when the
+# outer where clause trims the range.
+SELECT_RECORD_BUCKETS = """
+    SELECT
+        bucket,
+        amount,
+        count,
+        progress
+    FROM (
+        SELECT
+            bucket,
+            SUM(amount) as amount,
+            COUNT(*) as count,
+            SUM(SUM(amount)) OVER (ORDER BY bucket) as progress
+        FROM (
+            SELECT
+                (date - :origin) / :width - ((date - :origin) % :width < 0) as bucket,
+                amount
+            FROM
+                records
+            WHERE
+                goal_id = :goal_id
+        )
+        GROUP BY
+            bucket
+    )
+    {where_clause}
+    ORDER BY
+        bucket
+    ;
+"""
+
+INSERT_RECORD = """
+    INSERT INTO records(
+        id,
+        goal_id,
+        date,
+        amount,
+        created_date
+    ) VALUES(?,?,?,?,?);
+"""
+
+# Queries that should be served from an index, with representative arguments
+# for checking their plans
+INDEXED_QUERIES = {
+    "get_goal": (
+        SELECT_GOALS.format(where_clause="WHERE goals.id=?"),
+        [""],
+    ),
+    "get_records_for_goal": (
+        SELECT_RECORDS.format(where_clause="WHERE goal_id=?"),
+        [""],
+    ),
+    "get_records_for_goal_in_interval": (
+        SELECT_RECORDS.format(where_clause="WHERE goal_id=? AND date>=? AND date<=?"),
+        ["", "", ""],
+    ),
+    "get_record_series_for_goal": (
+        SELECT_RECORD_SERIES.format(where_clause="WHERE goal_id=?"),
+        [""],
+    ),
+    "get_records_page": (
+        SELECT_RECORDS_PAGE.format(
+            where_clause="WHERE (date, created_date, id) > (:date, :created_date, :id)"
+        ),
+        {"date": "", "created_date": "", "id": "", "limit": 1},
+    ),
+    "get_record_offsets": (
+        SELECT_RECORD_OFFSETS.format(conditions=""),
+        {"goal_ids": "[]", "date": "", "created_date": "", "id": ""},
+    ),
+    "get_records_page_for_goal": (
+        SELECT_RECORDS_PAGE.format(
+            where_clause="WHERE goal_id=:goal_id AND (date, created_date, id) > (:date, :created_date, :id)"
+        ),
+        {"goal_id": "", "date": "", "created_date": "", "id": "", "limit": 1},
+    ),
+}
+
+
+@instrument_methods(DBInterface)
 class GoalsDB(DBInterface):
     path = "backend/goals.db"
 
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        pool_size: int = POOL_SIZE,
+    ) -> None:
         super().__init__()
+        if path is not None:
+            self.path = path
+        self.pool = ConnectionPool(
+            self.path,
+            size=pool_size,
+            factory=TracingConnection if QUERY_TRACING else sqlite3.Connection,
+        )
         self.create_tables()
 
+        # Bumped after every committed write. The instance id tells versions
+        # from different processes, or before and after a restart, apart.
+        self.instance_id = uuid4().hex
+        self._data_version = 0
+        self._data_version_lock = threading.Lock()
+
+    def close(self):
+        self.pool.close()
+
+    @property
+    def data_version(self) -> str:
+        return f"{self.instance_id}.{self._data_version}"
+
+    def bump_data_version(self):
+        with self._data_version_lock:
+            self._data_version += 1
+
+    # Called after every committed write with the goals it changed. The data
+    # version is bumped last, once anything serving the old data is gone.
+    def committed(
+        self,
+        *goal_ids: UUID,
+    ):
+        self.bump_data_version()
+
+    def checkpoint(self) -> tuple[int, int, int]:
+        return self.pool.checkpoint()
+
     def create_tables(self):
-        self.create_goals_table()
-        self.create_records_table()
+        with self.pool.connection() as connection:
+            migrate(connection)
+        self.analyze()
 
-    def create_goals_table(self):
-        with closing(sqlite3.connect(self.path)) as connection:
+    def analyze(self):
+        with self.pool.connection() as connection:
             with closing(connection.cursor()) as cursor:
-                connection.execute("PRAGMA foreign_keys = ON")
-                cursor.execute(
-                    """
-                    CREATE TABLE IF NOT EXISTS goals (
-                        id TEXT PRIMARY KEY,
-                        name TEXT NOT NULL,
-                        interval_start_date TEXT,
-                        interval_start_amount REAL,
-                        interval_target_amount REAL,
-                        interval_length_seconds TEXT,
-                        bucket_size_seconds TEXT,
-                        unit str,
-                        reset bool,
-                        created_date TEXT DEFAULT CURRENT_TIMESTAMP
-                    );
-                    """
-                )
+                # Gather statistics on first run, after that let SQLite decide
+                # whether they are stale enough to be worth refreshing
+                cursor.execute("SELECT 1 FROM sqlite_master WHERE name='sqlite_stat1';")
+                if cursor.fetchone() is None:
+                    cursor.execute("ANALYZE;")
+                else:
+                    cursor.execute("PRAGMA optimize;")
+                connection.commit()
 
-    def create_records_table(self):
-        with closing(sqlite3.connect(self.path)) as connection:
+    def check_query_plans(
+        self,
+    ) -> dict[str, list[str]]:
+        unindexed = {}
+        with self.pool.connection() as connection:
             with closing(connection.cursor()) as cursor:
-                connection.execute("PRAGMA foreign_keys = ON")
-                cursor.execute(
-                    """
-                    CREATE TABLE IF NOT EXISTS records (
-                        id TEXT PRIMARY KEY,
-                        goal_id TEXT,
-                        date TEXT,
-                        amount REAL,
-                        created_date TEXT DEFAULT CURRENT_TIMESTAMP,
-                        FOREIGN KEY (goal_id) REFERENCES goals(id) ON DELETE CASCADE
-                    );
-                    """
-                )
+                for name, (query, args) in INDEXED_QUERIES.items():
+                    cursor.execute(f"EXPLAIN QUERY PLAN {query}", args)
+                    plan = [str(row[3]) for row in cursor.fetchall()]
+                    if any(detail.startswith("SCAN records") for detail in plan):
+                        unindexed[name] = plan
+
+        for name, plan in unindexed.items():
+            logging.warning(
+                "Query '%s' scans the records table: %s", name, "; ".join(plan)
+            )
+        return unindexed
 
     def create_goal(
         self,
         goal: Goal,
     ):
-        with closing(sqlite3.connect(self.path)) as connection:
+        with self.pool.connection() as connection:
             with closing(connection.cursor()) as cursor:
-                connection.execute("PRAGMA foreign_keys = ON")
                 cursor.execute(
                     """
                     INSERT INTO goals(
@@ -160,50 +719,19 @@ class GoalsDB(DBInterface):
                     """,
                     [
                         str(goal.id),
-                        goal.name,
-                        goal.interval_start_date,
-                        goal.interval_start_amount,
-                        goal.interval_target_amount,
-                        goal.interval_length.total_seconds(),
-                        goal.bucket_size.total_seconds(),
-                        goal.unit,
-                        goal.reset,
-                        goal.created_date,
+                        *goal_args(goal),
                     ],
                 )
                 connection.commit()
+                self.committed(goal.id)
 
     def get_goals(
         self,
     ) -> list[Goal]:
-        with closing(sqlite3.connect(self.path)) as connection:
+        with self.pool.connection() as connection:
             with closing(connection.cursor()) as cursor:
-                connection.execute("PRAGMA foreign_keys = ON")
                 cursor.execute(
-                    """
-                    SELECT
-                        goals.id,
-                        goals.name,
-                        datetime(goals.interval_start_date,'utc') as interval_start_date,
-                        goals.interval_start_amount,
-                        goals.interval_target_amount,
-                        goals.interval_length_seconds,
-                        goals.bucket_size_seconds,
-                        goals.unit,
-                        goals.reset,
-                        datetime(goals.created_date,'utc') as created_date,
-                        SUM(records.amount) as progress
-                    FROM 
-                        goals
-                    LEFT OUTER JOIN
-                        records ON goals.id = records.goal_id
-                    GROUP BY
-                        goals.id
-                    ORDER BY 
-                        interval_start_date, 
-                        created_date
-                    ;
-                    """,
+                    SELECT_GOALS.format(where_clause=""),
                 )
 
                 return [read_goal(row) for row in cursor.fetchall()]
@@ -212,36 +740,10 @@ class GoalsDB(DBInterface):
         self,
         goal_id: UUID,
     ) -> Goal:
-        with closing(sqlite3.connect(self.path)) as connection:
+        with self.pool.connection() as connection:
             with closing(connection.cursor()) as cursor:
-                connection.execute("PRAGMA foreign_keys = ON")
                 cursor.execute(
-                    """
-                    SELECT
-                        goals.id,
-                        goals.name,
-                        datetime(goals.interval_start_date,'utc') as interval_start_date,
-                        goals.interval_start_amount,
-                        goals.interval_target_amount,
-                        goals.interval_length_seconds,
-                        goals.bucket_size_seconds,
-                        goals.unit,
-                        goals.reset,
-                        datetime(goals.created_date,'utc') as created_date,
-                        SUM(records.amount) as progress
-                    FROM 
-                        goals
-                    LEFT OUTER JOIN
-                        records ON goals.id = records.goal_id
-                    WHERE
-                        goals.id=?
-                    GROUP BY
-                        goals.id
-                    ORDER BY 
-                        interval_start_date, 
-                        created_date
-                    ;
-                    """,
+                    SELECT_GOALS.format(where_clause="WHERE goals.id=?"),
                     [
                         str(goal_id),
                     ],
@@ -255,13 +757,26 @@ class GoalsDB(DBInterface):
 
                 return read_goal(row)
 
+    def get_goals_with_records(
+        self,
+    ) -> list[GoalWithRecords]:
+        with self.pool.connection() as connection:
+            with closing(connection.cursor()) as cursor:
+                cursor.execute(
+                    SELECT_GOALS_WITH_RECORDS,
+                )
+
+                return [
+                    read_goal_with_records(list(rows))
+                    for _, rows in groupby(cursor, key=lambda row: row[0])
+                ]
+
     def update_goal(
         self,
         goal: Goal,
     ) -> Goal:
-        with closing(sqlite3.connect(self.path)) as connection:
+        with self.pool.connection() as connection:
             with closing(connection.cursor()) as cursor:
-                connection.execute("PRAGMA foreign_keys = ON")
                 cursor.execute(
                     """
                     UPDATE goals
@@ -275,18 +790,20 @@ class GoalsDB(DBInterface):
                         reset = ?,
                         created_date = ?
                     WHERE id = ?
-                    RETURNING *;
+                    RETURNING
+                        id,
+                        name,
+                        interval_start_date,
+                        interval_start_amount,
+                        interval_target_amount,
+                        interval_length_seconds,
+                        bucket_size_seconds,
+                        unit,
+                        reset,
+                        created_date;
                     """,
                     [
-                        goal.name,
-                        goal.interval_start_date,
-                        goal.interval_start_amount,
-                        goal.interval_target_amount,
-                        goal.interval_length.total_seconds(),
-                        goal.bucket_size.total_seconds(),
-                        goal.unit,
-                        goal.reset,
-                        goal.created_date,
+                        *goal_args(goal),
                         str(goal.id),
                     ],
                 )
@@ -297,27 +814,27 @@ class GoalsDB(DBInterface):
                         message=f"Goal not found for id={goal.id}"
                     )
                 connection.commit()
+                self.committed(goal.id)
 
                 return Goal(
                     id=row[0],
                     name=str(row[1]),
-                    interval_start_date=row[2],
+                    interval_start_date=timestamp_to_datetime(row[2]),
                     interval_start_amount=row[3],
                     interval_target_amount=row[4],
-                    interval_length=timedelta(seconds=float(row[5])),
-                    bucket_size=timedelta(seconds=float(row[6])),
+                    interval_length=timedelta(seconds=row[5]),
+                    bucket_size=timedelta(seconds=row[6]),
                     unit=str(row[7]),
                     reset=row[8],
-                    created_date=row[9],
+                    created_date=timestamp_to_datetime(row[9]),
                 )
 
     def delete_goal(
         self,
         goal_id: UUID,
     ):
-        with closing(sqlite3.connect(self.path)) as connection:
+        with self.pool.connection() as connection:
             with closing(connection.cursor()) as cursor:
-                connection.execute("PRAGMA foreign_keys = ON")
                 cursor.execute(
                     """
                     DELETE FROM goals 
@@ -328,143 +845,327 @@ class GoalsDB(DBInterface):
                     ],
                 )
                 connection.commit()
+                self.committed(goal_id)
 
     def create_record(
         self,
         record: Record,
     ):
-        with closing(sqlite3.connect(self.path)) as connection:
+        with self.pool.connection() as connection:
+            with closing(connection.cursor()) as cursor:
+                cursor.execute(
+                    INSERT_RECORD,
+                    record_args(record),
+                )
+                connection.commit()
+                self.committed(record.goal_id)
+
+    def create_records(
+        self,
+        records: list[Record],
+    ) -> list[RecordCreateResult]:
+        with self.pool.connection() as connection:
             with closing(connection.cursor()) as cursor:
-                connection.execute("PRAGMA foreign_keys = ON")
+                # Take the write lock up front so the checks below still hold
+                # when the batch is inserted
+                cursor.execute("BEGIN IMMEDIATE;")
+
                 cursor.execute(
                     """
-                    INSERT INTO records(
-                        id,
-                        goal_id,
-                        date,
-                        amount,
-                        created_date
-                    ) VALUES(?,?,?,?,?);
+                    SELECT id FROM goals
+                    WHERE id IN (SELECT value FROM json_each(?));
                     """,
                     [
-                        str(record.id),
-                        str(record.goal_id),
-                        record.date,
-                        record.amount,
-                        record.created_date,
+                        json.dumps(list({str(record.goal_id) for record in records})),
                     ],
                 )
+                goal_ids = {row[0] for row in cursor.fetchall()}
+
+                cursor.execute(
+                    """
+                    SELECT id FROM records
+                    WHERE id IN (SELECT value FROM json_each(?));
+                    """,
+                    [
+                        json.dumps([str(record.id) for record in records]),
+                    ],
+                )
+                record_ids = {row[0] for row in cursor.fetchall()}
+
+                results = []
+                inserts = []
+                for record in records:
+                    if str(record.goal_id) not in goal_ids:
+                        results.append(
+                            RecordCreateResult(
+                                id=record.id,
+                                created=False,
+                                error=f"Goal not found for id={record.goal_id}",
+                            )
+                        )
+                    elif str(record.id) in record_ids:
+                        results.append(
+                            RecordCreateResult(
+                                id=record.id,
+                                created=False,
+                                error=f"Record already exists for id={record.id}",
+                            )
+                        )
+                    else:
+                        record_ids.add(str(record.id))
+                        inserts.append((len(results), record_args(record)))
+                        results.append(
+                            RecordCreateResult(
+                                id=record.id,
+                                created=True,
+                            )
+                        )
+
+                for index, error in insert_records(cursor, inserts).items():
+                    results[index] = RecordCreateResult(
+                        id=results[index].id,
+                        created=False,
+                        error=f"Record could not be created: {error}",
+                    )
                 connection.commit()
+                self.committed(*{record.goal_id for record in records})
+
+                return results
 
     def get_records(
         self,
+        max_points: Optional[int] = None,
     ) -> list[Record]:
-        with closing(sqlite3.connect(self.path)) as connection:
+        with self.pool.connection() as connection:
             with closing(connection.cursor()) as cursor:
-                connection.execute("PRAGMA foreign_keys = ON")
                 cursor.execute(
-                    """
-                    SELECT
-                        id,
-                        goal_id,
-                        datetime(date,'utc') as date,
-                        amount,
-                        datetime(created_date,'utc') as created_date,
-                        SUM (amount) OVER (PARTITION BY goal_id ORDER BY date) as progress   
-                    FROM 
-                        records
-                    ORDER BY 
-                        date, 
-                        created_date
-                    ;
-                    """,
+                    SELECT_RECORDS.format(where_clause=""),
+                )
+                records = [read_record(row) for row in cursor.fetchall()]
+
+        if max_points is not None:
+            return downsample_records(records, max_points)
+        return records
+
+    def iter_records(
+        self,
+        goal_id: Optional[UUID] = None,
+        chunk_size: int = EXPORT_CHUNK_SIZE,
+    ) -> Iterator[list]:
+        where_clause = ""
+        args = []
+        if goal_id is not None:
+            where_clause = "WHERE goal_id=?"
+            args = [
+                str(goal_id),
+            ]
+
+        # Exports are read at the client's pace, so they do not hold one of
+        # the pool's connections while they last
+        with self.pool.dedicated_connection() as connection:
+            with closing(connection.cursor()) as cursor:
+                cursor.execute(
+                    SELECT_RECORDS.format(where_clause=where_clause),
+                    args,
                 )
-                return [read_record(row) for row in cursor.fetchall()]
+                while rows := cursor.fetchmany(chunk_size):
+                    yield rows
+
+    def get_records_page(
+        self,
+        limit: int,
+        page_token: Optional[str] = None,
+        goal_id: Optional[UUID] = None,
+        interval_start_date: Optional[datetime] = None,
+        interval_end_date: Optional[datetime] = None,
+    ) -> RecordPage:
+        conditions = []
+        args = {
+            "limit": limit,
+        }
+
+        if goal_id is not None:
+            conditions.append("goal_id=:goal_id")
+            args["goal_id"] = str(goal_id)
+        if interval_start_date is not None:
+            conditions.append("date>=:interval_start_date")
+            args["interval_start_date"] = datetime_to_timestamp(interval_start_date)
+        if interval_end_date is not None:
+            conditions.append("date<=:interval_end_date")
+            args["interval_end_date"] = datetime_to_timestamp(interval_end_date)
+
+        key = None
+        progress = None
+        if page_token is not None:
+            key, progress = decode_page_token(page_token)
+            conditions.append("(date, created_date, id) > (:date, :created_date, :id)")
+            args["date"], args["created_date"], args["id"] = key
+
+        where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        with self.pool.connection() as connection:
+            with closing(connection.cursor()) as cursor:
+                cursor.execute(
+                    SELECT_RECORDS_PAGE.format(where_clause=where_clause),
+                    args,
+                )
+                rows = cursor.fetchall()
+
+                offsets = {}
+                if goal_id is not None and progress is not None:
+                    offsets = {str(goal_id): progress}
+                elif key is not None and rows:
+                    cursor.execute(
+                        SELECT_RECORD_OFFSETS.format(
+                            conditions=(
+                                "AND date>=:interval_start_date"
+                                if interval_start_date is not None
+                                else ""
+                            )
+                        ),
+                        {
+                            **args,
+                            "goal_ids": json.dumps(list({row[1] for row in rows})),
+                        },
+                    )
+                    offsets = dict(cursor.fetchall())
+
+        records = [read_record(row, offsets.get(row[1], 0.0)) for row in rows]
+
+        next_page_token = None
+        if len(rows) == limit:
+            last_row = rows[-1]
+            next_page_token = encode_page_token(
+                key=[last_row[2], last_row[4], last_row[0]],
+                progress=records[-1].progress if goal_id is not None else None,
+            )
+
+        return RecordPage.model_construct(
+            records=records,
+            next_page_token=next_page_token,
+        )
 
     def get_records_for_goal(
         self,
         goal_id: UUID,
         interval_start_date: Optional[datetime] = None,
         interval_end_date: Optional[datetime] = None,
+        max_points: Optional[int] = None,
     ) -> list[Record]:
-        where_clause = ""
-        args = [
-            str(goal_id),
-        ]
+        where_clause, args = goal_interval_filter(
+            goal_id,
+            interval_start_date,
+            interval_end_date,
+        )
 
-        if interval_start_date is not None:
-            if interval_end_date is not None:
-                where_clause = "goal_id=? AND date>=? AND date<=?"
-                args = [
-                    str(goal_id),
-                    interval_start_date,
-                    interval_end_date,
-                ]
-            else:
-                where_clause = "goal_id=? AND date>=?"
-                args = [
-                    str(goal_id),
-                    interval_start_date,
-                ]
-        else:
-            if interval_end_date is not None:
-                where_clause = "goal_id=? AND date<=?"
-                args = [
-                    str(goal_id),
-                    interval_end_date,
-                ]
-            else:
-                where_clause = "goal_id=?"
-                args = [
-                    str(goal_id),
-                ]
+        with self.pool.connection() as connection:
+            with closing(connection.cursor()) as cursor:
+                cursor.execute(
+                    SELECT_RECORDS.format(where_clause=f"WHERE {where_clause}"),
+                    args,
+                )
+                records = [read_record(row) for row in cursor.fetchall()]
+
+        if max_points is not None:
+            return downsample_records(records, max_points)
+        return records
 
-        with closing(sqlite3.connect(self.path)) as connection:
+    def get_record_series_for_goal(
+        self,
+        goal_id: UUID,
+        interval_start_date: Optional[datetime] = None,
+        interval_end_date: Optional[datetime] = None,
+        max_points: Optional[int] = None,
+    ) -> RecordSeries:
+        where_clause, args = goal_interval_filter(
+            goal_id,
+            interval_start_date,
+            interval_end_date,
+        )
+
+        with self.pool.connection() as connection:
             with closing(connection.cursor()) as cursor:
-                connection.execute("PRAGMA foreign_keys = ON")
                 cursor.execute(
-                    f"""
+                    SELECT_RECORD_SERIES.format(where_clause=f"WHERE {where_clause}"),
+                    args,
+                )
+                rows = cursor.fetchall()
+
+        if max_points is not None:
+            rows = lttb(rows, max_points, x=itemgetter(0), y=itemgetter(2))
+
+        return read_record_series(goal_id, rows)
+
+    def get_record_buckets_for_goal(
+        self,
+        goal_id: UUID,
+        interval_start_date: Optional[datetime] = None,
+        interval_end_date: Optional[datetime] = None,
+    ) -> list[RecordBucket]:
+        with self.pool.connection() as connection:
+            with closing(connection.cursor()) as cursor:
+                cursor.execute(
+                    """
                     SELECT
-                        id,
-                        goal_id,
-                        datetime(date,'utc') as date,
-                        amount,
-                        datetime(created_date,'utc') as created_date,
-                        SUM (amount) OVER (PARTITION BY goal_id ORDER BY date) as progress
-                    FROM 
-                        records
-                    WHERE 
-                        {where_clause}
-                    ORDER BY 
-                        date, 
-                        created_date
-                    ;
+                        interval_start_date,
+                        bucket_size_seconds
+                    FROM
+                        goals
+                    WHERE
+                        id=?
                     """,
+                    [
+                        str(goal_id),
+                    ],
+                )
+
+                row = cursor.fetchone()
+                if row is None:
+                    raise ResourceNotFoundException(
+                        message=f"Goal not found for id={goal_id}"
+                    )
+
+                origin = row[0]
+                width = timedelta(seconds=row[1]) // MICROSECOND
+                if width <= 0:
+                    raise InvalidRequestException(
+                        message=f"Goal id={goal_id} has a non-positive bucket size"
+                    )
+
+                conditions = []
+                args = {
+                    "goal_id": str(goal_id),
+                    "origin": origin,
+                    "width": width,
+                }
+                if interval_start_date is not None:
+                    conditions.append("bucket>=:first_bucket")
+                    args["first_bucket"] = (
+                        datetime_to_timestamp(interval_start_date) - origin
+                    ) // width
+                if interval_end_date is not None:
+                    conditions.append("bucket<=:last_bucket")
+                    args["last_bucket"] = (
+                        datetime_to_timestamp(interval_end_date) - origin
+                    ) // width
+                where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+                cursor.execute(
+                    SELECT_RECORD_BUCKETS.format(where_clause=where_clause),
                     args,
                 )
-                return [read_record(row) for row in cursor.fetchall()]
+                return [
+                    read_record_bucket(row, origin, width) for row in cursor.fetchall()
+                ]
 
     def get_record(
         self,
         record_id: UUID,
     ) -> Record:
-        with closing(sqlite3.connect(self.path)) as connection:
+        with self.pool.connection() as connection:
             with closing(connection.cursor()) as cursor:
-                connection.execute("PRAGMA foreign_keys = ON")
                 cursor.execute(
-                    """
-                    SELECT
-                        id,
-                        goal_id,
-                        datetime(date,'utc') as date,
-                        amount,
-                        datetime(created_date,'utc') as created_date,
-                        SUM (amount) OVER (PARTITION BY goal_id ORDER BY date) as progress
-                    FROM 
-                        records
-                    WHERE 
-                        id=? 
-                    """,
+                    SELECT_RECORDS.format(where_clause="WHERE id=?"),
                     [
                         str(record_id),
                     ],
@@ -478,28 +1179,36 @@ class GoalsDB(DBInterface):
 
                 return read_record(row)
 
+    # Returns the goal the record belonged to, if it existed
     def delete_record(
         self,
         record_id: UUID,
-    ):
-        with closing(sqlite3.connect(self.path)) as connection:
+    ) -> Optional[UUID]:
+        with self.pool.connection() as connection:
             with closing(connection.cursor()) as cursor:
-                connection.execute("PRAGMA foreign_keys = ON")
                 cursor.execute(
                     """
                     DELETE FROM records 
                     WHERE id=?
+                    RETURNING goal_id;
                     """,
                     [
                         str(record_id),
                     ],
                 )
+                row = cursor.fetchone()
                 connection.commit()
+                if row is None:
+                    return None
 
+                goal_id = UUID(row[0])
+                self.committed(goal_id)
+                return goal_id
 
-goals_db = GoalsDB()
 
 if __name__ == "__main__":
+    goals_db = GoalsDB()
+
     print("\n == Create Goal == ")
     goals_db.create_goal(
         Goal(
@@ -0,0 +1,54 @@
+from typing import Callable, Sequence, TypeVar
+
+T = TypeVar("T")
+
+
+# Largest-Triangle-Three-Buckets: keeps the first and last points and, for each
+# of the max_points - 2 buckets in between, the point forming the largest
+# triangle with the previously kept point and the average of the next bucket.
+# This keeps the peaks and turns of the series that a chart would show.
+def lttb(
+    points: Sequence[T],
+    max_points: int,
+    x: Callable[[T], float],
+    y: Callable[[T], float],
+) -> list[T]:
+    if max_points < 3:
+        raise ValueError(f"max_points must be at least 3, got {max_points}")
+
+    if len(points) <= max_points:
+        return list(points)
+
+    xs = [x(point) for point in points]
+    ys = [y(point) for point in points]
+
+    sampled = [points[0]]
+    bucket_width = (len(points) - 2) / (max_points - 2)
+    previous = 0
+
+    for bucket in range(max_points - 2):
+        start = int(bucket * bucket_width) + 1
+        end = int((bucket + 1) * bucket_width) + 1
+
+        next_start = end
+        next_end = min(int((bucket + 2) * bucket_width) + 1, len(points))
+        next_count = next_end - next_start
+        average_x = sum(xs[next_start:next_end]) / next_count
+        average_y = sum(ys[next_start:next_end]) / next_count
+
+        selected = start
+        largest_area = -1.0
+        for index in range(start, end):
+            area = abs(
+                (xs[previous] - average_x) * (ys[index] - ys[previous])
+                - (xs[previous] - xs[index]) * (average_y - ys[previous])
+            )
+            if area > largest_area:
+                largest_area = area
+                selected = index
+
+        sampled.append(points[selected])
+        previous = selected
+
+    sampled.append(points[-1])
+    return sampled
@@ -0,0 +1,122 @@
+from functools import lru_cache
+from typing import Any, Callable, Optional
+
+from fastapi import Request, Response
+from pydantic import TypeAdapter
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON_MEDIA_TYPE = "application/json"
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+
+
+# Turns a response body into bytes, given the content and the pydantic
+# adapter for its type
+class Encoding:
+    def __init__(
+        self,
+        media_type: str,
+        encode_model: Callable[[TypeAdapter, Any], bytes],
+        aliases: tuple[str, ...] = (),
+    ) -> None:
+        self.media_type = media_type
+        self.encode_model = encode_model
+        self.aliases = aliases
+
+    def matches(
+        self,
+        media_type: str,
+    ) -> bool:
+        return media_type == self.media_type or media_type in self.aliases
+
+
+# pydantic-core writes JSON straight from the models, skipping the
+# jsonable_encoder pass and the intermediate dicts
+JSON = Encoding(
+    JSON_MEDIA_TYPE,
+    encode_model=lambda adapter, content: adapter.dump_json(content),
+)
+
+ENCODINGS = [JSON]
+
+if msgpack is not None:
+    # Values are dumped as they would be for JSON, so both encodings carry
+    # the same strings for ids, dates and durations
+    MSGPACK = Encoding(
+        MSGPACK_MEDIA_TYPE,
+        encode_model=lambda adapter, content: msgpack.packb(
+            adapter.dump_python(content, mode="json")
+        ),
+        aliases=("application/x-msgpack",),
+    )
+    ENCODINGS.append(MSGPACK)
+
+
+@lru_cache(maxsize=None)
+def get_adapter(content_type: Any) -> TypeAdapter:
+    return TypeAdapter(content_type)
+
+
+def parse_accept(accept: str) -> list[tuple[str, float]]:
+    media_types = []
+    for part in accept.split(","):
+        media_type, *params = [value.strip() for value in part.split(";")]
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if media_type:
+            media_types.append((media_type.lower(), quality))
+    return media_types
+
+
+# The first encoding the client accepts with the highest quality. JSON is
+# served whenever nothing else matches, as it was before negotiation existed.
+def negotiate(
+    request: Request,
+    encodings: list[Encoding] = ENCODINGS,
+) -> Encoding:
+    accept = request.headers.get("accept")
+    if not accept:
+        return encodings[0]
+
+    best: Optional[Encoding] = None
+    best_quality = 0.0
+    for media_type, quality in parse_accept(accept):
+        if quality <= best_quality:
+            continue
+        for encoding in encodings:
+            if encoding.matches(media_type):
+                best = encoding
+                best_quality = quality
+                break
+    return best or encodings[0]
+
+
+# Builds the response for a route's content directly instead of returning the
+# content for FastAPI to validate and encode. The route's return annotation
+# still documents the schema. Headers already set on the route's `response`
+# are carried over.
+def encode_response(
+    request: Request,
+    response: Response,
+    content: Any,
+    content_type: Any,
+) -> Response:
+    encoding = negotiate(request)
+    body = encoding.encode_model(get_adapter(content_type), content)
+
+    encoded = Response(
+        content=body,
+        media_type=encoding.media_type,
+        headers=response.headers,
+    )
+    encoded.headers["Vary"] = "Accept"
+    return encoded
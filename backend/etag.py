@@ -0,0 +1,62 @@
+import hashlib
+from typing import Optional
+
+from fastapi import Request, Response
+
+
+# Strong ETag for a GET: the same data version, path, query and Accept header
+# always produce the same body. Anything else the body depends on goes in parts.
+def get_etag(
+    data_version: str,
+    request: Request,
+    *parts,
+) -> str:
+    key = "\n".join(
+        [
+            data_version,
+            request.url.path,
+            str(request.query_params),
+            # The body's encoding is negotiated on Accept
+            request.headers.get("accept", ""),
+            *map(str, parts),
+        ]
+    )
+    return f'"{hashlib.sha256(key.encode()).hexdigest()[:32]}"'
+
+
+def is_not_modified(
+    request: Request,
+    etag: str,
+) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is None:
+        return False
+
+    # If-None-Match compares weakly, so W/ tags match too
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
+# Tags the response and returns a 304 to send in its place if the client
+# already has this version. The data version must be read before the data, so
+# a write racing the read can only make the tag older than the body, never
+# newer.
+def conditional_get(
+    request: Request,
+    response: Response,
+    data_version: str,
+    *parts,
+) -> Optional[Response]:
+    etag = get_etag(data_version, request, *parts)
+    headers = {
+        "ETag": etag,
+        # Let browsers keep the body but check back before using it
+        "Cache-Control": "no-cache",
+        "Vary": "Accept",
+    }
+
+    if is_not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    response.headers.update(headers)
+    return None
@@ -1,7 +1,12 @@
-from fastapi import HTTPException
+from fastapi import HTTPException, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse
 from functools import wraps
-import sys
-import traceback
+import logging
+import math
+
+from metrics import HTTP_EXCEPTIONS
 
 
 class ResourceNotFoundException(Exception):
@@ -13,6 +18,23 @@ class ResourceNotFoundException(Exception):
         return f"ResourceNotFoundException: {self.message}"
 
 
+class InvalidRequestException(Exception):
+    def __init__(self, message="Invalid request"):
+        self.message = message
+        super().__init__(self.message)
+
+    def __str__(self):
+        return f"InvalidRequestException: {self.message}"
+
+
+def count_exception(f, error: Exception, status: int):
+    HTTP_EXCEPTIONS.inc(
+        route=f.__name__,
+        exception=type(error).__name__,
+        status=status,
+    )
+
+
 def handle_http_exceptions(f):
     @wraps(f)
     async def decorated(*args, **kwargs):
@@ -20,13 +42,37 @@ def handle_http_exceptions(f):
             return await f(*args, **kwargs)
 
         except ResourceNotFoundException as error:
+            count_exception(f, error, 404)
             raise HTTPException(status_code=404, detail=str(error))
 
+        except InvalidRequestException as error:
+            count_exception(f, error, 400)
+            raise HTTPException(status_code=400, detail=str(error))
+
         except Exception as error:
-            # TODO: Create an exception metric for tracing
-            print("Exception type", type(error).__name__)
-            print("An exception occurred:", error)
-            traceback.print_exception(*sys.exc_info())
+            count_exception(f, error, 500)
+            logging.exception("Unexpected %s in %s", type(error).__name__, f.__name__)
             raise HTTPException(status_code=500, detail="Unexpected error")
 
     return decorated
+
+
+def encode_float(value: float):
+    return value if math.isfinite(value) else str(value)
+
+
+# FastAPI's own handler, except that the inputs echoed back in each error are
+# encoded even when they are non-finite amounts, which JSON cannot hold
+async def request_validation_exception_handler(
+    request: Request,
+    error: RequestValidationError,
+) -> JSONResponse:
+    return JSONResponse(
+        status_code=422,
+        content={
+            "detail": jsonable_encoder(
+                error.errors(),
+                custom_encoder={float: encode_float},
+            )
+        },
+    )
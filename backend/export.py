@@ -0,0 +1,66 @@
+import csv
+import io
+import json
+from enum import Enum
+from typing import Iterable, Iterator
+
+from dates import timestamp_to_datetime
+
+RECORD_FIELDS = ["id", "goal_id", "date", "amount", "created_date", "progress"]
+
+
+class ExportFormat(str, Enum):
+    ndjson = "ndjson"
+    csv = "csv"
+
+
+MEDIA_TYPES = {
+    ExportFormat.ndjson: "application/x-ndjson",
+    ExportFormat.csv: "text/csv",
+}
+
+
+def export_date(timestamp: int) -> str:
+    return timestamp_to_datetime(timestamp).isoformat().replace("+00:00", "Z")
+
+
+def export_record_row(row) -> list:
+    return [
+        row[0],
+        row[1],
+        export_date(row[2]),
+        row[3],
+        export_date(row[4]),
+        row[5] if row[5] is not None else 0,
+    ]
+
+
+def ndjson_lines(chunks: Iterable[list]) -> Iterator[str]:
+    for rows in chunks:
+        yield "".join(
+            json.dumps(dict(zip(RECORD_FIELDS, export_record_row(row)))) + "\n"
+            for row in rows
+        )
+
+
+def csv_lines(chunks: Iterable[list]) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    writer.writerow(RECORD_FIELDS)
+    for rows in chunks:
+        writer.writerows(export_record_row(row) for row in rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+    yield buffer.getvalue()
+
+
+def export_records(
+    chunks: Iterable[list],
+    format: ExportFormat,
+) -> Iterator[str]:
+    if format == ExportFormat.csv:
+        return csv_lines(chunks)
+    return ndjson_lines(chunks)
@@ -1,6 +1,16 @@
+from datetime import datetime
+from typing import Iterator, Optional
 from uuid import UUID
 
-from models import Goal, Record
+from models import (
+    Goal,
+    GoalWithRecords,
+    Record,
+    RecordBucket,
+    RecordCreateResult,
+    RecordPage,
+    RecordSeries,
+)
 
 
 class DBInterface:
@@ -26,6 +36,17 @@ class DBInterface:
     ) -> Goal:
         raise NotImplementedError
 
+    def get_goals_with_records(
+        self,
+    ) -> list[GoalWithRecords]:
+        raise NotImplementedError
+
+    def update_goal(
+        self,
+        goal: Goal,
+    ) -> Goal:
+        raise NotImplementedError
+
     def delete_goal(
         self,
         goal_id: UUID,
@@ -38,11 +59,60 @@ class DBInterface:
     ):
         raise NotImplementedError
 
+    def create_records(
+        self,
+        records: list[Record],
+    ) -> list[RecordCreateResult]:
+        raise NotImplementedError
+
     def get_records(
         self,
+        max_points: Optional[int] = None,
     ) -> list[Record]:
         raise NotImplementedError
 
+    def get_records_page(
+        self,
+        limit: int,
+        page_token: Optional[str] = None,
+        goal_id: Optional[UUID] = None,
+        interval_start_date: Optional[datetime] = None,
+        interval_end_date: Optional[datetime] = None,
+    ) -> RecordPage:
+        raise NotImplementedError
+
+    def get_records_for_goal(
+        self,
+        goal_id: UUID,
+        interval_start_date: Optional[datetime] = None,
+        interval_end_date: Optional[datetime] = None,
+        max_points: Optional[int] = None,
+    ) -> list[Record]:
+        raise NotImplementedError
+
+    def get_record_series_for_goal(
+        self,
+        goal_id: UUID,
+        interval_start_date: Optional[datetime] = None,
+        interval_end_date: Optional[datetime] = None,
+        max_points: Optional[int] = None,
+    ) -> RecordSeries:
+        raise NotImplementedError
+
+    def get_record_buckets_for_goal(
+        self,
+        goal_id: UUID,
+        interval_start_date: Optional[datetime] = None,
+        interval_end_date: Optional[datetime] = None,
+    ) -> list[RecordBucket]:
+        raise NotImplementedError
+
+    def iter_records(
+        self,
+        goal_id: Optional[UUID] = None,
+    ) -> Iterator[list]:
+        raise NotImplementedError
+
     def get_record(
         self,
         record_id: UUID,
@@ -52,5 +122,5 @@ class DBInterface:
     def delete_record(
         self,
         record_id: UUID,
-    ):
+    ) -> Optional[UUID]:
         raise NotImplementedError
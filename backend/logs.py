@@ -0,0 +1,119 @@
+import logging
+import os
+import queue
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+LOG_FILE = os.getenv("GOALS_LOG_FILE", default="events.log")
+LOG_LEVEL = os.getenv("GOALS_LOG_LEVEL", default="INFO")
+LOG_MAX_BYTES = int(os.getenv("GOALS_LOG_MAX_BYTES", default=str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("GOALS_LOG_BACKUP_COUNT", default="5"))
+
+# Structured fields passed through `extra`, appended to the line as key=value
+LOG_FIELDS = (
+    "route",
+    "method",
+    "status",
+    "latency_ms",
+    "goal_id",
+    "record_id",
+    "count",
+)
+
+
+class StructuredFormatter(logging.Formatter):
+    def format(
+        self,
+        record: logging.LogRecord,
+    ) -> str:
+        line = super().format(record)
+        fields = [
+            f"{field}={record.__dict__[field]}"
+            for field in LOG_FIELDS
+            if field in record.__dict__
+        ]
+        if fields:
+            line = f"{line} {' '.join(fields)}"
+        return line
+
+
+# The stock QueueHandler formats the message before queueing it, which would
+# put the formatting back on the caller. Records are passed on as they are
+# and only formatted by the listener thread; callers must log with arguments
+# that are not mutated afterwards.
+class LazyQueueHandler(QueueHandler):
+    def prepare(
+        self,
+        record: logging.LogRecord,
+    ) -> logging.LogRecord:
+        return record
+
+
+# Routes all logging through a queue so that handlers only ever append to it;
+# the file writes and rotation happen on the listener's thread. Returns the
+# listener, which must be stopped to flush the queue on shutdown.
+def setup_logging(
+    path: str = LOG_FILE,
+    level: str = LOG_LEVEL,
+) -> QueueListener:
+    file_handler = RotatingFileHandler(
+        path,
+        maxBytes=LOG_MAX_BYTES,
+        backupCount=LOG_BACKUP_COUNT,
+    )
+    file_handler.setFormatter(
+        StructuredFormatter(
+            fmt="%(asctime)s %(message)s",
+            datefmt="%Y %b %d, %H:%M",
+        )
+    )
+
+    log_queue: queue.SimpleQueue[logging.LogRecord] = queue.SimpleQueue()
+    listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(LazyQueueHandler(log_queue))
+    root.setLevel(level)
+
+    listener.start()
+    return listener
+
+
+# Logs every HTTP request once it has been answered, with its route, status
+# and latency as structured fields
+class RequestLoggingMiddleware:
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            endpoint = scope.get("endpoint")
+            logging.info(
+                "%s %s %d",
+                scope["method"],
+                scope["path"],
+                status,
+                extra={
+                    "route": getattr(endpoint, "__name__", scope["path"]),
+                    "method": scope["method"],
+                    "status": status,
+                    "latency_ms": round((time.perf_counter() - start) * 1000, 3),
+                },
+            )
@@ -1,18 +1,11 @@
-import logging
 import os
 
 import uvicorn
+from logs import setup_logging
 
 if __name__ == "__main__":
     # setup logs
-    logging.basicConfig(
-        level=logging.INFO,
-        format="%(asctime)s %(message)s",
-        datefmt="%Y %b %d, %H:%M",
-        handlers=[
-            logging.FileHandler("events.log"),
-        ],
-    )
+    log_listener = setup_logging()
 
     # run api server
     config = uvicorn.Config(
@@ -23,3 +16,6 @@ if __name__ == "__main__":
     )
     server = uvicorn.Server(config)
     server.run()
+
+    # flush queued logs
+    log_listener.stop()
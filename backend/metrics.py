@@ -0,0 +1,363 @@
+import inspect
+import threading
+import time
+from functools import wraps
+from typing import Callable, Optional
+
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+# Starlette appends the charset to text types
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+
+def escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(
+    names: tuple[str, ...],
+    values: tuple,
+    extra: str = "",
+) -> str:
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+# Metrics in the Prometheus text exposition format, kept in process. Every
+# metric is registered on creation and rendered by `render`.
+class Metric:
+    type = "untyped"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: tuple[str, ...] = (),
+        registry: Optional[list["Metric"]] = None,
+    ) -> None:
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self._lock = threading.Lock()
+        (REGISTRY if registry is None else registry).append(self)
+
+    def label_values(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, "") for name in self.label_names)
+
+    def samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        return "\n".join(
+            [
+                f"# HELP {self.name} {self.help}",
+                f"# TYPE {self.name} {self.type}",
+                *self.samples(),
+            ]
+        )
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._values: dict[tuple, float] = {}
+
+    def inc(
+        self,
+        amount: float = 1,
+        **labels,
+    ):
+        key = self.label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self._values.get(self.label_values(labels), 0)
+
+    def samples(self) -> list[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [
+            f"{self.name}{format_labels(self.label_names, key)} {format_value(value)}"
+            for key, value in values
+        ]
+
+
+# Either set directly or read from a callback at render time, which suits
+# values owned by someone else such as pool and cache sizes
+class Gauge(Metric):
+    type = "gauge"
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._values: dict[tuple, float] = {}
+        self._functions: dict[tuple, Callable[[], float]] = {}
+
+    def set(
+        self,
+        value: float,
+        **labels,
+    ):
+        with self._lock:
+            self._values[self.label_values(labels)] = value
+
+    def set_function(
+        self,
+        function: Callable[[], float],
+        **labels,
+    ):
+        with self._lock:
+            self._functions[self.label_values(labels)] = function
+
+    def samples(self) -> list[str]:
+        with self._lock:
+            values = dict(self._values)
+            functions = list(self._functions.items())
+        for key, function in functions:
+            values[key] = function()
+        return [
+            f"{self.name}{format_labels(self.label_names, key)} {format_value(value)}"
+            for key, value in values.items()
+        ]
+
+
+# Counter semantics for a total someone else keeps, read at render time
+class CounterFunction(Gauge):
+    type = "counter"
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        *args,
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+        **kwargs,
+    ) -> None:
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._counts: dict[tuple, list[int]] = {}
+        self._sums: dict[tuple, float] = {}
+
+    def observe(
+        self,
+        value: float,
+        **labels,
+    ):
+        key = self.label_values(labels)
+        with self._lock:
+            counts = self._counts.get(key)
+            if counts is None:
+                counts = self._counts[key] = [0] * len(self.buckets)
+                self._sums[key] = 0.0
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            self._sums[key] += value
+
+    def samples(self) -> list[str]:
+        with self._lock:
+            series = [
+                (key, list(counts), self._sums[key])
+                for key, counts in self._counts.items()
+            ]
+
+        lines = []
+        for key, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = format_labels(
+                    self.label_names, key, f'le="{format_value(bound)}"'
+                )
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+REGISTRY: list[Metric] = []
+
+
+def render(registry: Optional[list[Metric]] = None) -> str:
+    metrics = REGISTRY if registry is None else registry
+    return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+DB_QUERY_SECONDS = Histogram(
+    "goals_db_query_seconds",
+    "Time spent in each GoalsDB method.",
+    labels=("method",),
+)
+DB_ROWS = Counter(
+    "goals_db_rows_total",
+    "Rows returned or written by each GoalsDB method.",
+    labels=("method",),
+)
+DB_EXCEPTIONS = Counter(
+    "goals_db_exceptions_total",
+    "Exceptions raised by each GoalsDB method.",
+    labels=("method", "exception"),
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "goals_http_request_seconds",
+    "Time to answer each HTTP request, by route.",
+    labels=("route", "method", "status"),
+)
+HTTP_EXCEPTIONS = Counter(
+    "goals_http_exceptions_total",
+    "Exceptions raised by route handlers.",
+    labels=("route", "exception", "status"),
+)
+POOL_CONNECTIONS = Gauge(
+    "goals_db_pool_connections",
+    "Connections held by the GoalsDB pool.",
+    labels=("state",),
+)
+CACHE_REQUESTS = CounterFunction(
+    "goals_cache_requests_total",
+    "Goal cache lookups.",
+    labels=("result",),
+)
+CACHE_ENTRIES = Gauge(
+    "goals_cache_entries",
+    "Entries in the goal cache.",
+)
+
+
+def count_rows(result) -> int:
+    if result is None:
+        return 0
+    if isinstance(result, list):
+        return len(result)
+    for field in ("records", "dates"):
+        if isinstance(getattr(result, field, None), list):
+            return len(getattr(result, field))
+    return 1
+
+
+# Times a GoalsDB method and counts its rows and exceptions. Generators are
+# timed from their first to last chunk, counting the rows of every chunk.
+def instrument(
+    function: Callable,
+    name: Optional[str] = None,
+) -> Callable:
+    method = name or function.__name__
+
+    if inspect.isgeneratorfunction(function):
+
+        @wraps(function)
+        def instrumented_generator(*args, **kwargs):
+            start = time.perf_counter()
+            rows = 0
+            try:
+                for chunk in function(*args, **kwargs):
+                    rows += count_rows(chunk)
+                    yield chunk
+            except Exception as error:
+                DB_EXCEPTIONS.inc(method=method, exception=type(error).__name__)
+                raise
+            finally:
+                DB_QUERY_SECONDS.observe(time.perf_counter() - start, method=method)
+                DB_ROWS.inc(rows, method=method)
+
+        return instrumented_generator
+
+    @wraps(function)
+    def instrumented(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            result = function(*args, **kwargs)
+        except Exception as error:
+            DB_EXCEPTIONS.inc(method=method, exception=type(error).__name__)
+            raise
+        finally:
+            DB_QUERY_SECONDS.observe(time.perf_counter() - start, method=method)
+        DB_ROWS.inc(count_rows(result), method=method)
+        return result
+
+    return instrumented
+
+
+# Class decorator instrumenting the methods the class implements from an
+# interface
+def instrument_methods(interface: type) -> Callable[[type], type]:
+    def decorate(cls: type) -> type:
+        for name in vars(interface):
+            function = vars(cls).get(name)
+            if not name.startswith("_") and inspect.isfunction(function):
+                setattr(cls, name, instrument(function))
+        return cls
+
+    return decorate
+
+
+def register_db_gauges(db):
+    POOL_CONNECTIONS.set_function(lambda: db.pool.open_count, state="open")
+    POOL_CONNECTIONS.set_function(lambda: db.pool.idle_count, state="idle")
+
+    cache = getattr(db, "cache", None)
+    if cache is not None:
+        CACHE_REQUESTS.set_function(lambda: cache.hits, result="hit")
+        CACHE_REQUESTS.set_function(lambda: cache.misses, result="miss")
+        CACHE_ENTRIES.set_function(lambda: len(cache))
+
+
+# Observes the latency of every HTTP request by route. Requests that match no
+# route share one label so that arbitrary paths cannot grow the series.
+class MetricsMiddleware:
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            endpoint = scope.get("endpoint")
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - start,
+                route=getattr(endpoint, "__name__", "unmatched"),
+                method=scope["method"],
+                status=status,
+            )
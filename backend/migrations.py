@@ -0,0 +1,659 @@
+import argparse
+import logging
+import os
+import sqlite3
+import time
+from contextlib import closing, contextmanager
+from datetime import datetime
+from typing import Callable, Iterator, Optional
+
+from dates import datetime_to_timestamp
+
+MIGRATION_BATCH_SIZE = int(os.getenv("GOALS_DB_MIGRATION_BATCH_SIZE", default="10000"))
+MIGRATION_BATCH_PAUSE_MS = float(
+    os.getenv("GOALS_DB_MIGRATION_BATCH_PAUSE_MS", default="0")
+)
+
+
+# A schema change identified by the user_version it moves the database to.
+#
+# `apply` and `finish` each run in their own transaction, and the version is
+# only bumped in the same transaction as `finish`, so a failed migration is
+# retried from the start on the next run; both should be idempotent.
+# `backfill` runs between them in batches, one transaction per batch, which
+# keeps each transaction and the WAL small. It is given the key the previous
+# batch stopped at (None at first) and returns the key to continue from, or
+# None when there is nothing left. The key is saved with each batch, so an
+# interrupted backfill resumes where it stopped.
+#
+# GoalsDB runs pending migrations before it serves anything, and the code
+# only reads the schema they lead to, so a backfill cannot run beside it.
+# Instead `--backfill` runs everything up to the end of the first backfill
+# from the command line while the previous release is still serving; `apply`
+# installs triggers that note the rows that release writes in the meantime,
+# and `finish` converts those before swapping the schema. The new release
+# then only waits for `finish`. So everything `--backfill` runs must be safe
+# for the previous release, and `apply` and `finish` should only change the
+# schema or build indexes, never rewrite a table.
+class Migration:
+    def __init__(
+        self,
+        version: int,
+        name: str,
+        apply: Optional[Callable[[sqlite3.Cursor], None]] = None,
+        backfill: Optional[
+            Callable[[sqlite3.Cursor, Optional[int], int], Optional[int]]
+        ] = None,
+        finish: Optional[Callable[[sqlite3.Cursor], None]] = None,
+    ) -> None:
+        self.version = version
+        self.name = name
+        self.apply = apply
+        self.backfill = backfill
+        self.finish = finish
+
+    def __str__(self) -> str:
+        return f"Migration {self.version}: {self.name}"
+
+
+def get_columns(
+    cursor: sqlite3.Cursor,
+    table: str,
+) -> dict[str, str]:
+    cursor.execute(f"PRAGMA table_info({table});")
+    return {row[1]: row[2] for row in cursor.fetchall()}
+
+
+def read_legacy_date(date_str: Optional[str]) -> Optional[int]:
+    if date_str is None:
+        return None
+    return datetime_to_timestamp(datetime.fromisoformat(date_str))
+
+
+def read_legacy_seconds(seconds: Optional[str]) -> Optional[float]:
+    if seconds is None:
+        return None
+    return float(seconds)
+
+
+# 1
+def create_tables(cursor: sqlite3.Cursor):
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS goals (
+            id TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            interval_start_date TEXT,
+            interval_start_amount REAL,
+            interval_target_amount REAL,
+            interval_length_seconds TEXT,
+            bucket_size_seconds TEXT,
+            unit str,
+            reset bool,
+            created_date TEXT DEFAULT CURRENT_TIMESTAMP
+        );
+        """
+    )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS records (
+            id TEXT PRIMARY KEY,
+            goal_id TEXT,
+            date TEXT,
+            amount REAL,
+            created_date TEXT DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (goal_id) REFERENCES goals(id) ON DELETE CASCADE
+        );
+        """
+    )
+
+
+# 2
+def add_records_amount(cursor: sqlite3.Cursor):
+    if "records_amount" not in get_columns(cursor, "goals"):
+        cursor.execute(
+            """
+            ALTER TABLE goals
+            ADD COLUMN records_amount REAL NOT NULL DEFAULT 0;
+            """
+        )
+        # One grouped pass over records: no index on goal_id exists yet, so
+        # a subquery per goal would scan the whole table once per goal
+        cursor.execute(
+            """
+            UPDATE goals
+            SET records_amount = totals.amount
+            FROM (
+                SELECT goal_id, SUM(amount) AS amount
+                FROM records
+                GROUP BY goal_id
+            ) AS totals
+            WHERE totals.goal_id = goals.id;
+            """
+        )
+
+    # Keep the total in step with every record write, in the same
+    # transaction as the write itself
+    cursor.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS records_amount_insert
+        AFTER INSERT ON records
+        BEGIN
+            UPDATE goals
+            SET records_amount = records_amount + NEW.amount
+            WHERE id = NEW.goal_id;
+        END;
+        """
+    )
+    cursor.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS records_amount_delete
+        AFTER DELETE ON records
+        BEGIN
+            UPDATE goals
+            SET records_amount = records_amount - OLD.amount
+            WHERE id = OLD.goal_id;
+        END;
+        """
+    )
+    cursor.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS records_amount_update
+        AFTER UPDATE OF goal_id, amount ON records
+        BEGIN
+            UPDATE goals
+            SET records_amount = records_amount - OLD.amount
+            WHERE id = OLD.goal_id;
+            UPDATE goals
+            SET records_amount = records_amount + NEW.amount
+            WHERE id = NEW.goal_id;
+        END;
+        """
+    )
+
+
+# 3
+def create_record_indexes(cursor: sqlite3.Cursor):
+    # Covers the per-goal range scans, pages and progress window without
+    # touching the table
+    cursor.execute("DROP INDEX IF EXISTS records_goal_id_date;")
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS records_goal_id_keyset
+        ON records (goal_id, date, created_date, id, amount);
+        """
+    )
+
+    # Lets pages of all records seek straight to their key
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS records_keyset
+        ON records (date, created_date, id);
+        """
+    )
+
+
+# 4: TEXT dates become integer microseconds since the Unix epoch and TEXT
+# durations become REAL seconds. Each column is copied into a typed
+# `<column>_new` column, batch by batch, then the old column is renamed to
+# `<column>_legacy` and the new one renamed over it. Nothing reads the legacy
+# columns; `drop_legacy_columns` removes them.
+#
+# Rows the previous release inserts or updates while the backfill runs are
+# noted in TYPED_COLUMNS_PENDING by triggers, in plain SQL so that release's
+# own connections can run them, and converted by the swap.
+TYPED_COLUMNS = {
+    "goals": {
+        "interval_start_date": ("INTEGER", read_legacy_date),
+        "interval_length_seconds": ("REAL", read_legacy_seconds),
+        "bucket_size_seconds": ("REAL", read_legacy_seconds),
+        "created_date": ("INTEGER", read_legacy_date),
+    },
+    "records": {
+        "date": ("INTEGER", read_legacy_date),
+        "created_date": ("INTEGER", read_legacy_date),
+    },
+}
+TYPED_COLUMNS_PENDING = "typed_columns_pending"
+
+
+def get_untyped_columns(
+    cursor: sqlite3.Cursor,
+    table: str,
+) -> list[str]:
+    columns = get_columns(cursor, table)
+    return [
+        column
+        for column, (column_type, _) in TYPED_COLUMNS[table].items()
+        if columns.get(column) != column_type
+    ]
+
+
+def add_typed_columns(cursor: sqlite3.Cursor):
+    cursor.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {TYPED_COLUMNS_PENDING} (
+            table_name TEXT NOT NULL,
+            row_id INTEGER NOT NULL,
+            PRIMARY KEY (table_name, row_id)
+        ) WITHOUT ROWID;
+        """
+    )
+
+    for table, typed_columns in TYPED_COLUMNS.items():
+        columns = get_columns(cursor, table)
+        untyped_columns = get_untyped_columns(cursor, table)
+        if not untyped_columns:
+            continue
+
+        for column in untyped_columns:
+            if f"{column}_new" not in columns:
+                column_type, _ = typed_columns[column]
+                cursor.execute(
+                    f"ALTER TABLE {table} ADD COLUMN {column}_new {column_type};"
+                )
+
+        # An inserted row can reuse the rowid of a deleted one the backfill
+        # has already passed, so inserts are noted as well as updates
+        cursor.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_typed_columns_insert
+            AFTER INSERT ON {table}
+            BEGIN
+                INSERT OR IGNORE INTO {TYPED_COLUMNS_PENDING}
+                VALUES ('{table}', NEW.rowid);
+            END;
+            """
+        )
+        cursor.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_typed_columns_update
+            AFTER UPDATE OF {", ".join(untyped_columns)} ON {table}
+            BEGIN
+                INSERT OR IGNORE INTO {TYPED_COLUMNS_PENDING}
+                VALUES ('{table}', NEW.rowid);
+            END;
+            """
+        )
+
+
+def backfill_typed_columns(
+    cursor: sqlite3.Cursor,
+    after_rowid: Optional[int],
+    batch_size: int,
+) -> Optional[int]:
+    # Goals are few, so they are converted in the first batch
+    if after_rowid is None:
+        backfill_table(cursor, "goals", -1, None)
+        after_rowid = -1
+
+    return backfill_table(cursor, "records", after_rowid, batch_size)
+
+
+def backfill_table(
+    cursor: sqlite3.Cursor,
+    table: str,
+    after_rowid: int,
+    batch_size: Optional[int],
+) -> Optional[int]:
+    columns = get_untyped_columns(cursor, table)
+    if not columns:
+        return None
+
+    cursor.execute(
+        f"""
+        SELECT rowid, {", ".join(columns)}
+        FROM {table}
+        WHERE rowid > ?
+        ORDER BY rowid
+        {"LIMIT ?" if batch_size is not None else ""}
+        ;
+        """,
+        [after_rowid, batch_size] if batch_size is not None else [after_rowid],
+    )
+    rows = cursor.fetchall()
+    if not rows:
+        return None
+
+    convert_rows(cursor, table, columns, rows)
+    return rows[-1][0]
+
+
+def convert_rows(
+    cursor: sqlite3.Cursor,
+    table: str,
+    columns: list[str],
+    rows: list[tuple],
+):
+    converters = [TYPED_COLUMNS[table][column][1] for column in columns]
+    cursor.executemany(
+        f"""
+        UPDATE {table}
+        SET {", ".join(f"{column}_new = ?" for column in columns)}
+        WHERE rowid = ?;
+        """,
+        [
+            [convert(value) for convert, value in zip(converters, row[1:])] + [row[0]]
+            for row in rows
+        ],
+    )
+
+
+# Converts the rows written since the backfill went past them, and stops
+# noting new ones
+def convert_pending_rows(cursor: sqlite3.Cursor):
+    for table in TYPED_COLUMNS:
+        cursor.execute(f"DROP TRIGGER IF EXISTS {table}_typed_columns_insert;")
+        cursor.execute(f"DROP TRIGGER IF EXISTS {table}_typed_columns_update;")
+
+        columns = get_untyped_columns(cursor, table)
+        if not columns:
+            continue
+        cursor.execute(
+            f"""
+            SELECT rowid, {", ".join(columns)}
+            FROM {table}
+            WHERE rowid IN (
+                SELECT row_id FROM {TYPED_COLUMNS_PENDING} WHERE table_name = ?
+            );
+            """,
+            [table],
+        )
+        convert_rows(cursor, table, columns, cursor.fetchall())
+
+    cursor.execute(f"DROP TABLE IF EXISTS {TYPED_COLUMNS_PENDING};")
+
+
+def swap_typed_columns(cursor: sqlite3.Cursor):
+    convert_pending_rows(cursor)
+
+    # The indexes follow a renamed column, so they are rebuilt on the typed
+    # columns afterwards. Building them is what this step spends its time on,
+    # a few seconds per million records.
+    cursor.execute("DROP INDEX IF EXISTS records_goal_id_keyset;")
+    cursor.execute("DROP INDEX IF EXISTS records_keyset;")
+
+    for table in TYPED_COLUMNS:
+        cursor.execute(f"SELECT EXISTS (SELECT 1 FROM {table});")
+        empty = not cursor.fetchone()[0]
+        for column in get_untyped_columns(cursor, table):
+            # Dropping a column rewrites the whole table, so unless there is
+            # nothing to rewrite the old column is only renamed out of the way
+            if empty:
+                cursor.execute(f"ALTER TABLE {table} DROP COLUMN {column};")
+            else:
+                cursor.execute(
+                    f"ALTER TABLE {table} RENAME COLUMN {column} TO {column}_legacy;"
+                )
+            cursor.execute(
+                f"ALTER TABLE {table} RENAME COLUMN {column}_new TO {column};"
+            )
+
+    create_record_indexes(cursor)
+
+
+def get_legacy_columns(
+    cursor: sqlite3.Cursor,
+    table: str,
+) -> list[str]:
+    columns = get_columns(cursor, table)
+    return [
+        f"{column}_legacy"
+        for column in TYPED_COLUMNS[table]
+        if f"{column}_legacy" in columns
+    ]
+
+
+MIGRATIONS = [
+    Migration(
+        1,
+        "create goals and records tables",
+        apply=create_tables,
+    ),
+    Migration(
+        2,
+        "maintain goals.records_amount with triggers",
+        apply=add_records_amount,
+    ),
+    Migration(
+        3,
+        "index records by goal and date",
+        apply=create_record_indexes,
+    ),
+    Migration(
+        4,
+        "store dates as timestamps and durations as seconds",
+        apply=add_typed_columns,
+        backfill=backfill_typed_columns,
+        finish=swap_typed_columns,
+    ),
+]
+
+
+def get_version(connection: sqlite3.Connection) -> int:
+    return connection.execute("PRAGMA user_version;").fetchone()[0]
+
+
+# Each step is a transaction of its own, begun IMMEDIATE so that a batch that
+# has read its rows cannot then fail to write them because the serving
+# release wrote in between. Inside the dry run's transaction a step is only a
+# savepoint, so everything is undone by the final rollback.
+@contextmanager
+def step(connection: sqlite3.Connection) -> Iterator[sqlite3.Cursor]:
+    with closing(connection.cursor()) as cursor:
+        begun = not connection.in_transaction
+        if begun:
+            cursor.execute("BEGIN IMMEDIATE;")
+        cursor.execute("SAVEPOINT migration_step;")
+        try:
+            yield cursor
+        except BaseException:
+            cursor.execute("ROLLBACK TO migration_step;")
+            cursor.execute("RELEASE migration_step;")
+            if begun:
+                connection.rollback()
+            raise
+        cursor.execute("RELEASE migration_step;")
+        if begun:
+            connection.commit()
+
+
+# Where the backfill of a migration stopped, kept until the migration
+# finishes
+def get_backfill_key(
+    cursor: sqlite3.Cursor,
+    migration: Migration,
+) -> Optional[int]:
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS migration_backfills (
+            version INTEGER PRIMARY KEY,
+            key INTEGER NOT NULL
+        );
+        """
+    )
+    cursor.execute(
+        "SELECT key FROM migration_backfills WHERE version = ?;",
+        [migration.version],
+    )
+    row = cursor.fetchone()
+    return row[0] if row is not None else None
+
+
+def save_backfill_key(
+    cursor: sqlite3.Cursor,
+    migration: Migration,
+    key: int,
+):
+    cursor.execute(
+        "INSERT OR REPLACE INTO migration_backfills VALUES (?, ?);",
+        [migration.version, key],
+    )
+
+
+def run_migration(
+    connection: sqlite3.Connection,
+    migration: Migration,
+    batch_size: int,
+    batch_pause_ms: float = 0,
+    finish: bool = True,
+):
+    if migration.apply is not None:
+        with step(connection) as cursor:
+            migration.apply(cursor)
+
+    if migration.backfill is not None:
+        with step(connection) as cursor:
+            key = get_backfill_key(cursor, migration)
+        resumed = key is not None
+
+        batches = 0
+        while True:
+            with step(connection) as cursor:
+                key = migration.backfill(cursor, key, batch_size)
+                if key is not None:
+                    save_backfill_key(cursor, migration, key)
+            if key is None:
+                break
+            if batches == 0 and finish and not resumed:
+                logging.warning(
+                    "%s: backfilling before serving. Run migrations.py "
+                    "--backfill while the previous release serves to do this "
+                    "ahead of time.",
+                    migration,
+                )
+            # SQLite does not queue writers, so without a gap between batches
+            # the serving release's writes can wait out a whole backfill
+            time.sleep(batch_pause_ms / 1000)
+            batches += 1
+            if batches % 100 == 0:
+                logging.warning("%s: backfilled %d batches", migration, batches)
+
+    if not finish:
+        return
+
+    with step(connection) as cursor:
+        if migration.finish is not None:
+            migration.finish(cursor)
+        if migration.backfill is not None:
+            cursor.execute("DROP TABLE IF EXISTS migration_backfills;")
+        cursor.execute(f"PRAGMA user_version = {migration.version};")
+
+
+# Runs the pending migrations and returns the ones it finished. With
+# `backfill` it stops after the first backfill, leaving that migration to
+# finish on the next run.
+def migrate(
+    connection: sqlite3.Connection,
+    dry_run: bool = False,
+    batch_size: int = MIGRATION_BATCH_SIZE,
+    batch_pause_ms: float = MIGRATION_BATCH_PAUSE_MS,
+    migrations: list[Migration] = MIGRATIONS,
+    backfill: bool = False,
+) -> list[Migration]:
+    version = get_version(connection)
+    pending = [migration for migration in migrations if migration.version > version]
+    if not pending:
+        return pending
+
+    if connection.in_transaction:
+        connection.commit()
+
+    finished = []
+    if dry_run:
+        connection.execute("BEGIN;")
+    try:
+        for migration in pending:
+            if backfill and migration.backfill is not None:
+                logging.warning(
+                    "%s %s",
+                    "Rehearsing backfill of" if dry_run else "Backfilling",
+                    migration,
+                )
+                run_migration(
+                    connection,
+                    migration,
+                    batch_size,
+                    batch_pause_ms,
+                    finish=False,
+                )
+                break
+
+            logging.warning("%s %s", "Rehearsing" if dry_run else "Applying", migration)
+            run_migration(connection, migration, batch_size, batch_pause_ms)
+            finished.append(migration)
+    finally:
+        if dry_run:
+            connection.rollback()
+
+    return finished
+
+
+# Drops the columns migration 4 left behind. Each drop rewrites its table
+# while holding the write lock, so this is only run on request, from the
+# command line.
+def drop_legacy_columns(connection: sqlite3.Connection) -> list[str]:
+    dropped = []
+    with step(connection) as cursor:
+        for table in TYPED_COLUMNS:
+            for column in get_legacy_columns(cursor, table):
+                cursor.execute(f"ALTER TABLE {table} DROP COLUMN {column};")
+                dropped.append(f"{table}.{column}")
+    return dropped
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Goals database migrations")
+    parser.add_argument("path", type=str, help="Location of the goals database.")
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Run the pending migrations in a transaction and roll it back.",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=MIGRATION_BATCH_SIZE,
+        help="Rows per backfill transaction.",
+    )
+    parser.add_argument(
+        "--batch-pause-ms",
+        type=float,
+        default=MIGRATION_BATCH_PAUSE_MS,
+        help="Pause between backfill transactions, leaving the write lock to "
+        "the app. With --backfill, smaller batches and a pause of a few "
+        "milliseconds keep its writes from waiting on the backfill.",
+    )
+    parser.add_argument(
+        "--backfill",
+        action="store_true",
+        help="Run the pending migrations up to the end of the first backfill, "
+        "leaving the rest to the app. Run while the previous release serves.",
+    )
+    parser.add_argument(
+        "--drop-legacy-columns",
+        action="store_true",
+        help="Drop the columns migration 4 renamed out of the way, rewriting "
+        "both tables. Run while the app is stopped.",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    with closing(sqlite3.connect(args.path)) as connection:
+        connection.execute("PRAGMA foreign_keys = ON")
+        print(f"Current version: {get_version(connection)}")
+        finished = migrate(
+            connection,
+            dry_run=args.dry_run,
+            batch_size=args.batch_size,
+            batch_pause_ms=args.batch_pause_ms,
+            backfill=args.backfill,
+        )
+        for migration in finished:
+            print(f"{'Would apply' if args.dry_run else 'Applied'} {migration}")
+        print(f"Version: {get_version(connection)}")
+
+        if args.drop_legacy_columns and not args.dry_run:
+            for column in drop_legacy_columns(connection):
+                print(f"Dropped {column}")
@@ -22,7 +22,10 @@ class Goal(BaseModel):
         default_factory=datetime_now,
     )
     progress: Optional[float] = None
+    # Where the target line is at the time the goal was served, and how
+    # fast it climbs from interval_start_amount, per second
     goal_progress: Optional[float] = None
+    goal_progress_rate: Optional[float] = None
 
     @model_validator(mode="after")
     def make_dates_timezone_aware(
@@ -38,7 +41,9 @@ class Record(BaseModel):
     )
     goal_id: UUID
     date: datetime
-    amount: float
+    amount: float = Field(
+        allow_inf_nan=False,
+    )
     created_date: datetime = Field(
         default_factory=datetime_now,
     )
@@ -50,3 +55,36 @@ class Record(BaseModel):
     ) -> "Record":
         self.date = get_timezone_aware_date(self.date)
         return self
+
+
+class GoalWithRecords(BaseModel):
+    goal: Goal
+    records: list[Record]
+
+
+class RecordBucket(BaseModel):
+    start_date: datetime
+    end_date: datetime
+    amount: float
+    count: int
+    progress: float
+
+
+class RecordCreateResult(BaseModel):
+    id: UUID
+    created: bool
+    error: Optional[str] = None
+
+
+class RecordPage(BaseModel):
+    records: list[Record]
+    next_page_token: Optional[str] = None
+
+
+# A goal's records as parallel columns, ordered by date: epoch milliseconds,
+# amounts and the running progress after each record
+class RecordSeries(BaseModel):
+    goal_id: UUID
+    dates: list[int]
+    amounts: list[float]
+    progress: list[float]
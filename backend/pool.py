@@ -0,0 +1,199 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from queue import Empty, Full, LifoQueue
+from typing import Iterator, Optional, Union
+
+POOL_SIZE = int(os.getenv("GOALS_DB_POOL_SIZE", default="5"))
+POOL_TIMEOUT_SECONDS = float(os.getenv("GOALS_DB_POOL_TIMEOUT", default="30"))
+
+# Applied to every connection as it is opened. WAL lets readers carry on
+# while a write commits; with WAL, synchronous=NORMAL only syncs on
+# checkpoints, which may lose the last commits on power loss but never
+# corrupts the database.
+PRAGMAS = {
+    "journal_mode": os.getenv("GOALS_DB_JOURNAL_MODE", default="WAL"),
+    "synchronous": os.getenv("GOALS_DB_SYNCHRONOUS", default="NORMAL"),
+    "mmap_size": int(os.getenv("GOALS_DB_MMAP_SIZE", default=str(256 * 1024 * 1024))),
+    # Negative sizes are in KiB rather than pages
+    "cache_size": int(os.getenv("GOALS_DB_CACHE_SIZE", default=str(-64 * 1024))),
+    "temp_store": os.getenv("GOALS_DB_TEMP_STORE", default="MEMORY"),
+    "busy_timeout": int(os.getenv("GOALS_DB_BUSY_TIMEOUT_MS", default="5000")),
+    "foreign_keys": "ON",
+}
+
+
+class PoolClosedException(Exception):
+    def __init__(self, message="Connection pool is closed"):
+        self.message = message
+        super().__init__(self.message)
+
+    def __str__(self):
+        return f"PoolClosedException: {self.message}"
+
+
+class PoolTimeoutException(Exception):
+    def __init__(self, message="Timed out waiting for a database connection"):
+        self.message = message
+        super().__init__(self.message)
+
+    def __str__(self):
+        return f"PoolTimeoutException: {self.message}"
+
+
+# A bounded pool of long-lived connections, opened lazily with the pragmas
+# profile applied once and health checked on checkout
+class ConnectionPool:
+    def __init__(
+        self,
+        path: str,
+        size: int = POOL_SIZE,
+        timeout: float = POOL_TIMEOUT_SECONDS,
+        pragmas: Optional[dict[str, Union[str, int]]] = None,
+        factory: type[sqlite3.Connection] = sqlite3.Connection,
+    ) -> None:
+        if size < 1:
+            raise ValueError(f"Pool size must be at least 1, got {size}")
+
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self.pragmas = PRAGMAS if pragmas is None else pragmas
+        self.factory = factory
+
+        self._idle: LifoQueue[sqlite3.Connection] = LifoQueue(maxsize=size)
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._open_count = 0
+        self._closed = False
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    @property
+    def open_count(self) -> int:
+        return self._open_count
+
+    @property
+    def idle_count(self) -> int:
+        return self._idle.qsize()
+
+    def open_connection(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(
+            self.path,
+            check_same_thread=False,
+            factory=self.factory,
+        )
+        for name, value in self.pragmas.items():
+            connection.execute(f"PRAGMA {name} = {value}")
+        with self._lock:
+            self._open_count += 1
+        return connection
+
+    def close_connection(
+        self,
+        connection: sqlite3.Connection,
+    ):
+        try:
+            connection.close()
+        except sqlite3.Error:
+            pass
+        finally:
+            with self._lock:
+                self._open_count -= 1
+
+    def is_healthy(
+        self,
+        connection: sqlite3.Connection,
+    ) -> bool:
+        try:
+            connection.execute("SELECT 1").fetchone()
+        except sqlite3.Error:
+            return False
+        return True
+
+    # Copies the WAL back into the database so it does not grow without
+    # bound. PASSIVE never waits on readers or writers; whatever it could not
+    # copy is left for the next checkpoint.
+    def checkpoint(
+        self,
+        mode: str = "PASSIVE",
+    ) -> tuple[int, int, int]:
+        with self.connection() as connection:
+            busy, log_frames, checkpointed_frames = connection.execute(
+                f"PRAGMA wal_checkpoint({mode})"
+            ).fetchone()
+        return busy, log_frames, checkpointed_frames
+
+    def acquire(self) -> sqlite3.Connection:
+        if self._closed:
+            raise PoolClosedException()
+
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolTimeoutException(
+                message=f"No connection available after {self.timeout}s (size={self.size})"
+            )
+
+        try:
+            while True:
+                try:
+                    connection = self._idle.get_nowait()
+                except Empty:
+                    return self.open_connection()
+
+                if self.is_healthy(connection):
+                    return connection
+                self.close_connection(connection)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(
+        self,
+        connection: sqlite3.Connection,
+    ):
+        try:
+            if connection.in_transaction:
+                connection.rollback()
+
+            if self._closed:
+                self.close_connection(connection)
+            else:
+                self._idle.put_nowait(connection)
+        except (sqlite3.Error, Full):
+            self.close_connection(connection)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        connection = self.acquire()
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    # A connection of its own, outside the pool's slots, for long reads such
+    # as exports that would otherwise keep a pooled connection from every
+    # other request for as long as a client takes to read them
+    @contextmanager
+    def dedicated_connection(self) -> Iterator[sqlite3.Connection]:
+        if self._closed:
+            raise PoolClosedException()
+
+        connection = self.open_connection()
+        try:
+            yield connection
+        finally:
+            self.close_connection(connection)
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                connection = self._idle.get_nowait()
+            except Empty:
+                break
+            self.close_connection(connection)
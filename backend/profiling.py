@@ -0,0 +1,205 @@
+import asyncio
+import os
+import random
+import re
+import sys
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Callable, Optional
+from uuid import uuid4
+
+PROFILING = os.getenv("GOALS_PROFILING", default="false").lower() == "true"
+PROFILE_SAMPLE_RATE = float(os.getenv("GOALS_PROFILE_SAMPLE_RATE", default="0.01"))
+PROFILE_HEADER = os.getenv("GOALS_PROFILE_HEADER", default="X-Profile")
+PROFILE_INTERVAL_MS = float(os.getenv("GOALS_PROFILE_INTERVAL_MS", default="1"))
+PROFILE_DIR = os.getenv("GOALS_PROFILE_DIR", default="profiles")
+PROFILE_KEEP = int(os.getenv("GOALS_PROFILE_KEEP", default="100"))
+
+PROFILE_SUFFIX = ".collapsed"
+PROFILE_NAME = re.compile(r"^[0-9TZ-]+-[0-9a-f]{8}$")
+
+# Innermost frames of threads that are only waiting for work
+IDLE_FRAMES = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+}
+
+
+def get_frame_label(frame) -> str:
+    code = frame.f_code
+    return (
+        f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    )
+
+
+def get_stack(frame) -> list[str]:
+    stack = []
+    while frame is not None:
+        stack.append(get_frame_label(frame))
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+def is_idle(frame) -> bool:
+    return (
+        os.path.basename(frame.f_code.co_filename),
+        frame.f_code.co_name,
+    ) in IDLE_FRAMES
+
+
+def get_db_thread_ids() -> dict[int, str]:
+    return {
+        thread.ident: thread.name
+        for thread in threading.enumerate()
+        if thread.ident is not None and thread.name.startswith("goals-db")
+    }
+
+
+# Samples the stacks of the event loop thread and the database threads until
+# stopped, counting each distinct stack. While a request is profiled its
+# handler runs on the loop and its queries on the database threads, so
+# together they cover both; other requests in flight at the same time are
+# sampled too. Threads that are only waiting for work are skipped.
+class StackSampler(threading.Thread):
+    def __init__(
+        self,
+        loop_thread_id: int,
+        interval: float = PROFILE_INTERVAL_MS / 1000,
+        get_thread_ids: Callable[[], dict[int, str]] = get_db_thread_ids,
+    ) -> None:
+        super().__init__(name="goals-profiler", daemon=True)
+        self.loop_thread_id = loop_thread_id
+        self.interval = interval
+        self.get_thread_ids = get_thread_ids
+        self.stacks: Counter[str] = Counter()
+        self._stopped = threading.Event()
+
+    def sample(self):
+        threads = {self.loop_thread_id: "event-loop", **self.get_thread_ids()}
+        frames = sys._current_frames()
+        for thread_id, thread_name in threads.items():
+            frame = frames.get(thread_id)
+            if frame is None or is_idle(frame):
+                continue
+            self.stacks[";".join([thread_name, *get_stack(frame)])] += 1
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            self.sample()
+
+    def stop(self) -> Counter[str]:
+        self._stopped.set()
+        self.join()
+        return self.stacks
+
+
+# Collapsed stacks ("frame;frame;frame count" per line) as read by
+# flamegraph.pl and speedscope, one file per profiled request
+class ProfileStore:
+    def __init__(
+        self,
+        directory: str = PROFILE_DIR,
+        keep: int = PROFILE_KEEP,
+    ) -> None:
+        self.directory = directory
+        self.keep = keep
+        self._lock = threading.Lock()
+
+    def new_name(self) -> str:
+        now = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+        return f"{now}-{uuid4().hex[:8]}"
+
+    def get_path(
+        self,
+        name: str,
+    ) -> Optional[str]:
+        if not PROFILE_NAME.match(name):
+            return None
+        return os.path.join(self.directory, f"{name}{PROFILE_SUFFIX}")
+
+    def list(self) -> list[str]:
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(
+            (
+                file_name.removesuffix(PROFILE_SUFFIX)
+                for file_name in os.listdir(self.directory)
+                if file_name.endswith(PROFILE_SUFFIX)
+            ),
+            reverse=True,
+        )
+
+    def save(
+        self,
+        name: str,
+        stacks: Counter[str],
+    ):
+        path = self.get_path(name)
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(path, "w") as file:
+                for stack, count in stacks.most_common():
+                    file.write(f"{stack} {count}\n")
+
+            for old_name in self.list()[self.keep :]:
+                os.remove(self.get_path(old_name))
+
+    def read(
+        self,
+        name: str,
+    ) -> Optional[str]:
+        path = self.get_path(name)
+        if path is None or not os.path.isfile(path):
+            return None
+        with open(path) as file:
+            return file.read()
+
+
+profile_store = ProfileStore()
+
+
+# Profiles a random PROFILE_SAMPLE_RATE of requests, and any request sending
+# the PROFILE_HEADER header, naming the saved profile in the same header of
+# the response. Only installed when GOALS_PROFILING is set.
+class ProfilingMiddleware:
+    def __init__(
+        self,
+        app,
+        sample_rate: float = PROFILE_SAMPLE_RATE,
+        header: str = PROFILE_HEADER,
+        store: ProfileStore = profile_store,
+    ) -> None:
+        self.app = app
+        self.sample_rate = sample_rate
+        self.header = header.lower().encode()
+        self.store = store
+
+    def is_profiled(self, scope) -> bool:
+        if any(name == self.header for name, _ in scope.get("headers", [])):
+            return True
+        return random.random() < self.sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.is_profiled(scope):
+            await self.app(scope, receive, send)
+            return
+
+        name = self.store.new_name()
+        sampler = StackSampler(threading.get_ident())
+
+        async def send_with_name(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((self.header, name.encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_with_name)
+        finally:
+            await asyncio.to_thread(self.store.save, name, sampler.stop())
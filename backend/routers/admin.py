@@ -0,0 +1,31 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import PlainTextResponse
+
+import metrics
+from profiling import profile_store
+
+router = APIRouter()
+
+
+# Read
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics() -> PlainTextResponse:
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+# Names of the saved profiles, newest first
+@router.get("/profiles")
+async def get_profiles() -> list[str]:
+    return profile_store.list()
+
+
+# Collapsed stacks, which speedscope and flamegraph.pl open as they are
+@router.get("/profiles/{name}", response_class=PlainTextResponse)
+async def get_profile(name: str) -> PlainTextResponse:
+    profile = profile_store.read(name)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return PlainTextResponse(
+        profile,
+        headers={"Content-Disposition": f'attachment; filename="{name}.collapsed"'},
+    )
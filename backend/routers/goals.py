@@ -1,10 +1,18 @@
 import logging
+from datetime import datetime
+from typing import Optional
 from uuid import UUID
 
-from db import goals_db
+from async_db import async_goals_db
+from db import PAGE_SIZE, downsample_records, get_progress_time, with_goal_progress
+from encoding import encode_response
+from etag import conditional_get
 from exceptions import handle_http_exceptions
-from fastapi import APIRouter
-from models import Goal, Record
+from export import MEDIA_TYPES, ExportFormat, export_records
+from fastapi import APIRouter, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from models import Goal, GoalWithRecords, Record, RecordBucket, RecordSeries
+from routers.records import NEXT_PAGE_TOKEN_HEADER
 
 router = APIRouter(
     prefix="/goals",
@@ -17,8 +25,8 @@ router = APIRouter(
 async def create_goal(
     goal: Goal,
 ) -> None:
-    logging.warn(f"Creating '{goal.name}'")
-    goals_db.create_goal(
+    logging.warning("Creating '%s'", goal.name, extra={"goal_id": goal.id})
+    await async_goals_db.create_goal(
         goal=goal,
     )
 
@@ -26,9 +34,57 @@ async def create_goal(
 # Read all
 @router.get("")
 @handle_http_exceptions
-async def get_goals() -> list[Goal]:
-    logging.debug(f"Getting Goals")
-    return goals_db.get_goals()
+async def get_goals(
+    request: Request,
+    response: Response,
+    as_of: Optional[datetime] = None,
+) -> list[Goal]:
+    logging.debug("Getting Goals")
+    as_of = as_of or get_progress_time()
+    not_modified = conditional_get(
+        request, response, async_goals_db.data_version, as_of
+    )
+    if not_modified is not None:
+        return not_modified
+
+    goals = await async_goals_db.get_goals()
+    return encode_response(
+        request,
+        response,
+        [with_goal_progress(goal, as_of) for goal in goals],
+        list[Goal],
+    )
+
+
+# Read all with their records
+@router.get("/records")
+@handle_http_exceptions
+async def get_goals_with_records(
+    request: Request,
+    response: Response,
+    as_of: Optional[datetime] = None,
+) -> list[GoalWithRecords]:
+    logging.debug("Getting Goals with Records")
+    as_of = as_of or get_progress_time()
+    not_modified = conditional_get(
+        request, response, async_goals_db.data_version, as_of
+    )
+    if not_modified is not None:
+        return not_modified
+
+    goals_with_records = await async_goals_db.get_goals_with_records()
+    return encode_response(
+        request,
+        response,
+        [
+            GoalWithRecords.model_construct(
+                goal=with_goal_progress(goal_with_records.goal, as_of),
+                records=goal_with_records.records,
+            )
+            for goal_with_records in goals_with_records
+        ],
+        list[GoalWithRecords],
+    )
 
 
 # Read one
@@ -36,10 +92,25 @@ async def get_goals() -> list[Goal]:
 @handle_http_exceptions
 async def get_goal(
     goal_id: UUID,
+    request: Request,
+    response: Response,
+    as_of: Optional[datetime] = None,
 ) -> Goal:
-    goal = goals_db.get_goal(goal_id)
-    logging.debug(f"Getting Goal '{goal.name}'")
-    return goal
+    as_of = as_of or get_progress_time()
+    not_modified = conditional_get(
+        request, response, async_goals_db.data_version, as_of
+    )
+    if not_modified is not None:
+        return not_modified
+
+    goal = await async_goals_db.get_goal(goal_id)
+    logging.debug("Getting Goal '%s'", goal.name, extra={"goal_id": goal_id})
+    return encode_response(
+        request,
+        response,
+        with_goal_progress(goal, as_of),
+        Goal,
+    )
 
 
 # Read all records for a goal
@@ -47,10 +118,111 @@ async def get_goal(
 @handle_http_exceptions
 async def get_goal_records(
     goal_id: UUID,
+    request: Request,
+    response: Response,
+    max_points: Optional[int] = Query(default=None, ge=3),
+    limit: Optional[int] = Query(default=None, ge=1),
+    page_token: Optional[str] = None,
 ) -> list[Record]:
-    goal = goals_db.get_goal(goal_id)
-    logging.debug(f"Getting Records for Goal '{goal.name}'")
-    return goals_db.get_records_for_goal(goal_id=goal_id)
+    not_modified = conditional_get(request, response, async_goals_db.data_version)
+    if not_modified is not None:
+        return not_modified
+
+    goal = await async_goals_db.get_goal(goal_id)
+    logging.debug(
+        "Getting Records for Goal '%s'", goal.name, extra={"goal_id": goal_id}
+    )
+    if limit is None and page_token is None:
+        records = await async_goals_db.get_records_for_goal(
+            goal_id=goal_id,
+            max_points=max_points,
+        )
+    else:
+        page = await async_goals_db.get_records_page(
+            limit=limit or PAGE_SIZE,
+            page_token=page_token,
+            goal_id=goal_id,
+        )
+        if page.next_page_token is not None:
+            response.headers[NEXT_PAGE_TOKEN_HEADER] = page.next_page_token
+        records = page.records
+        if max_points is not None:
+            records = downsample_records(records, max_points)
+
+    return encode_response(request, response, records, list[Record])
+
+
+# Read all records for a goal as parallel columns
+@router.get("/{goal_id}/records/series")
+@handle_http_exceptions
+async def get_goal_record_series(
+    goal_id: UUID,
+    request: Request,
+    response: Response,
+    interval_start_date: Optional[datetime] = None,
+    interval_end_date: Optional[datetime] = None,
+    max_points: Optional[int] = Query(default=None, ge=3),
+) -> RecordSeries:
+    not_modified = conditional_get(request, response, async_goals_db.data_version)
+    if not_modified is not None:
+        return not_modified
+
+    goal = await async_goals_db.get_goal(goal_id)
+    logging.debug(
+        "Getting Record Series for Goal '%s'", goal.name, extra={"goal_id": goal_id}
+    )
+    series = await async_goals_db.get_record_series_for_goal(
+        goal_id=goal_id,
+        interval_start_date=interval_start_date,
+        interval_end_date=interval_end_date,
+        max_points=max_points,
+    )
+    return encode_response(request, response, series, RecordSeries)
+
+
+# Export all records for a goal
+@router.get("/{goal_id}/records/export")
+@handle_http_exceptions
+async def export_goal_records(
+    goal_id: UUID,
+    format: ExportFormat = ExportFormat.ndjson,
+) -> StreamingResponse:
+    goal = await async_goals_db.get_goal(goal_id)
+    logging.debug(
+        "Exporting Records for Goal '%s' as %s",
+        goal.name,
+        format.value,
+        extra={"goal_id": goal_id},
+    )
+    return StreamingResponse(
+        export_records(async_goals_db.iter_records(goal_id=goal_id), format),
+        media_type=MEDIA_TYPES[format],
+    )
+
+
+# Read records for a goal summed into the goal's buckets
+@router.get("/{goal_id}/buckets")
+@handle_http_exceptions
+async def get_goal_record_buckets(
+    goal_id: UUID,
+    request: Request,
+    response: Response,
+    interval_start_date: Optional[datetime] = None,
+    interval_end_date: Optional[datetime] = None,
+) -> list[RecordBucket]:
+    logging.debug(
+        "Getting Record Buckets for Goal '%s'", goal_id, extra={"goal_id": goal_id}
+    )
+    not_modified = conditional_get(request, response, async_goals_db.data_version)
+    if not_modified is not None:
+        return not_modified
+
+    buckets = await async_goals_db.get_record_buckets_for_goal(
+        goal_id=goal_id,
+        interval_start_date=interval_start_date,
+        interval_end_date=interval_end_date,
+    )
+    return encode_response(request, response, buckets, list[RecordBucket])
 
 
 # Delete
@@ -59,6 +231,6 @@ async def get_goal_records(
 async def delete_goal(
     goal_id: UUID,
 ) -> None:
-    goal = goals_db.get_goal(goal_id)
-    logging.warn(f"Deleting '{goal.name}'")
-    goals_db.delete_goal(goal_id)
+    goal = await async_goals_db.get_goal(goal_id)
+    logging.warning("Deleting '%s'", goal.name, extra={"goal_id": goal_id})
+    await async_goals_db.delete_goal(goal_id)
@@ -1,10 +1,18 @@
 import logging
+from typing import Optional
 from uuid import UUID
 
-from db import goals_db
+from async_db import async_goals_db
+from db import PAGE_SIZE, downsample_records
+from encoding import encode_response
+from etag import conditional_get
 from exceptions import handle_http_exceptions
-from fastapi import APIRouter
-from models import Record
+from export import MEDIA_TYPES, ExportFormat, export_records
+from fastapi import APIRouter, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from models import Record, RecordCreateResult
+
+NEXT_PAGE_TOKEN_HEADER = "X-Next-Page-Token"
 
 router = APIRouter(
     prefix="/records",
@@ -17,19 +25,71 @@ router = APIRouter(
 async def create_record(
     record: Record,
 ) -> None:
-    goal = goals_db.get_goal(record.goal_id)
-    logging.warn(f"Creating Record for Goal '{goal.name}'")
-    goals_db.create_record(
+    goal = await async_goals_db.get_goal(record.goal_id)
+    logging.warning(
+        "Creating Record for Goal '%s'",
+        goal.name,
+        extra={"goal_id": record.goal_id, "record_id": record.id},
+    )
+    await async_goals_db.create_record(
         record=record,
     )
 
 
+# Create many
+@router.post("/bulk")
+@handle_http_exceptions
+async def create_records(
+    records: list[Record],
+) -> list[RecordCreateResult]:
+    logging.warning("Creating %d Records", len(records), extra={"count": len(records)})
+    return await async_goals_db.create_records(
+        records=records,
+    )
+
+
 # Read
 @router.get("")
 @handle_http_exceptions
-async def get_records() -> list[Record]:
-    logging.debug(f"Getting Records")
-    return goals_db.get_records()
+async def get_records(
+    request: Request,
+    response: Response,
+    max_points: Optional[int] = Query(default=None, ge=3),
+    limit: Optional[int] = Query(default=None, ge=1),
+    page_token: Optional[str] = None,
+) -> list[Record]:
+    logging.debug("Getting Records")
+    not_modified = conditional_get(request, response, async_goals_db.data_version)
+    if not_modified is not None:
+        return not_modified
+
+    if limit is None and page_token is None:
+        records = await async_goals_db.get_records(max_points=max_points)
+    else:
+        page = await async_goals_db.get_records_page(
+            limit=limit or PAGE_SIZE,
+            page_token=page_token,
+        )
+        if page.next_page_token is not None:
+            response.headers[NEXT_PAGE_TOKEN_HEADER] = page.next_page_token
+        records = page.records
+        if max_points is not None:
+            records = downsample_records(records, max_points)
+
+    return encode_response(request, response, records, list[Record])
+
+
+# Export
+@router.get("/export")
+@handle_http_exceptions
+async def export_records_file(
+    format: ExportFormat = ExportFormat.ndjson,
+) -> StreamingResponse:
+    logging.debug("Exporting Records as %s", format.value)
+    return StreamingResponse(
+        export_records(async_goals_db.iter_records(), format),
+        media_type=MEDIA_TYPES[format],
+    )
 
 
 # Delete
@@ -38,7 +98,11 @@ async def get_records() -> list[Record]:
 async def delete_record(
     record_id: UUID,
 ) -> None:
-    record = goals_db.get_record(record_id)
-    goal = goals_db.get_goal(record.goal_id)
-    logging.warn(f"Deleting Record for Goal '{goal.name}'")
-    goals_db.delete_record(record_id)
+    record = await async_goals_db.get_record(record_id)
+    goal = await async_goals_db.get_goal(record.goal_id)
+    logging.warning(
+        "Deleting Record for Goal '%s'",
+        goal.name,
+        extra={"goal_id": goal.id, "record_id": record_id},
+    )
+    await async_goals_db.delete_record(record_id)
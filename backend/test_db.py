@@ -0,0 +1,130 @@
+import base64
+import json
+from datetime import datetime, timedelta, timezone
+from uuid import uuid4
+
+import pytest
+from db import GoalsDB
+from exceptions import InvalidRequestException
+from models import Goal, Record
+
+START = datetime(2023, 1, 1, 8, 30, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = GoalsDB(str(tmp_path / "goals.db"))
+    yield db
+    db.close()
+
+
+def make_goal(db: GoalsDB) -> Goal:
+    goal = Goal(
+        name="Goal",
+        interval_start_date=START,
+        interval_start_amount=0,
+        interval_target_amount=100,
+        interval_length=timedelta(days=30),
+        bucket_size=timedelta(days=1),
+        unit="km",
+        reset=False,
+    )
+    db.create_goal(goal)
+    return goal
+
+
+def test_create_records_leaves_out_only_refused_rows(db):
+    goal = make_goal(db)
+    records = [
+        Record(goal_id=goal.id, date=START + timedelta(hours=index), amount=index)
+        for index in range(4)
+    ]
+    # Skips validation, as a caller handing over unchecked records would
+    not_a_number = Record.model_construct(
+        id=uuid4(),
+        goal_id=goal.id,
+        date=START,
+        amount=float("nan"),
+        created_date=START,
+    )
+    missing_goal = Record(goal_id=uuid4(), date=START, amount=1)
+
+    results = db.create_records(
+        [*records[:2], not_a_number, missing_goal, *records[2:]]
+    )
+
+    assert [result.created for result in results] == [
+        True,
+        True,
+        False,
+        False,
+        True,
+        True,
+    ]
+    assert results[2].error.startswith("Record could not be created")
+    assert [record.id for record in db.get_records_for_goal(goal.id)] == [
+        record.id for record in records
+    ]
+    assert db.get_goal(goal.id).progress == sum(record.amount for record in records)
+
+
+def read_all_pages(
+    db: GoalsDB,
+    limit: int,
+    **kwargs,
+) -> list[Record]:
+    records = []
+    page_token = None
+    while True:
+        page = db.get_records_page(limit=limit, page_token=page_token, **kwargs)
+        records.extend(page.records)
+        page_token = page.next_page_token
+        if page_token is None:
+            return records
+
+
+@pytest.mark.parametrize("limit", [1, 3, 7])
+@pytest.mark.parametrize("scoped", [False, True])
+def test_pages_add_up_to_the_full_listing(db, limit, scoped):
+    goals = [make_goal(db) for _ in range(3)]
+    db.create_records(
+        [
+            Record(
+                goal_id=goal.id,
+                date=START + timedelta(hours=index // 2),
+                amount=index + 0.25,
+            )
+            for index in range(20)
+            for goal in goals
+        ]
+    )
+
+    for kwargs in [{}, {"interval_start_date": START + timedelta(hours=3)}]:
+        if scoped:
+            kwargs["goal_id"] = goals[1].id
+        full = db.get_records_page(limit=1000, **kwargs).records
+        paged = read_all_pages(db, limit, **kwargs)
+
+        assert [record.id for record in paged] == [record.id for record in full]
+        assert [record.progress for record in paged] == pytest.approx(
+            [record.progress for record in full]
+        )
+
+
+@pytest.mark.parametrize(
+    "token",
+    [
+        {"key": [{}, 1, "a"]},
+        {"key": [1, 1.5, "a"]},
+        {"key": [1, 2, 3]},
+        {"key": [1, 2]},
+        {"key": [1, 2, "a"], "progress": "1"},
+        {"key": [1, 2, "a"], "progress": True},
+        {"key": [1, 2, "a"], "progress": float("nan")},
+        ["key"],
+    ],
+)
+def test_invalid_page_tokens_are_rejected(db, token):
+    page_token = base64.urlsafe_b64encode(json.dumps(token).encode()).decode()
+    with pytest.raises(InvalidRequestException):
+        db.get_records_page(limit=1, page_token=page_token)
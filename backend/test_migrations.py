@@ -0,0 +1,283 @@
+import sqlite3
+from contextlib import closing
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from db import GoalsDB
+from migrations import MIGRATIONS, drop_legacy_columns, get_version, migrate
+from models import Goal, Record
+
+START = datetime(2023, 1, 1, 8, 30, tzinfo=timezone.utc)
+
+
+def make_goals(count: int = 3) -> list[Goal]:
+    return [
+        Goal(
+            name=f"Goal {index}",
+            interval_start_date=START + timedelta(days=index),
+            interval_start_amount=index,
+            interval_target_amount=100,
+            interval_length=timedelta(days=30),
+            bucket_size=timedelta(hours=12),
+            unit="km",
+            reset=bool(index % 2),
+            created_date=START + timedelta(microseconds=123456 * (index + 1)),
+        )
+        for index in range(count)
+    ]
+
+
+def make_records(
+    goals: list[Goal],
+    per_goal: int = 5,
+) -> list[Record]:
+    return [
+        Record(
+            goal_id=goal.id,
+            date=START + timedelta(hours=index, microseconds=index),
+            amount=index + 0.5,
+            created_date=START + timedelta(hours=index, seconds=1),
+        )
+        for goal in goals
+        for index in range(per_goal)
+    ]
+
+
+# Rows as the code before migrations wrote them, with dates stored as
+# sqlite3 adapted them
+def insert_baseline_rows(
+    cursor: sqlite3.Cursor,
+    goals: list[Goal],
+    records: list[Record],
+):
+    cursor.executemany(
+        """
+        INSERT INTO goals(
+            id,
+            name,
+            interval_start_date,
+            interval_start_amount,
+            interval_target_amount,
+            interval_length_seconds,
+            bucket_size_seconds,
+            unit,
+            reset,
+            created_date
+        ) VALUES(?,?,?,?,?,?,?,?,?,?);
+        """,
+        [
+            [
+                str(goal.id),
+                goal.name,
+                str(goal.interval_start_date),
+                goal.interval_start_amount,
+                goal.interval_target_amount,
+                goal.interval_length.total_seconds(),
+                goal.bucket_size.total_seconds(),
+                goal.unit,
+                goal.reset,
+                str(goal.created_date),
+            ]
+            for goal in goals
+        ],
+    )
+    cursor.executemany(
+        """
+        INSERT INTO records(
+            id,
+            goal_id,
+            date,
+            amount,
+            created_date
+        ) VALUES(?,?,?,?,?);
+        """,
+        [
+            [
+                str(record.id),
+                str(record.goal_id),
+                str(record.date),
+                record.amount,
+                str(record.created_date),
+            ]
+            for record in records
+        ],
+    )
+
+
+# A database as the code before migrations left it: version 0 and the
+# original tables
+def create_baseline_db(
+    path: str,
+    goals: list[Goal],
+    records: list[Record],
+):
+    with closing(sqlite3.connect(path)) as connection:
+        with closing(connection.cursor()) as cursor:
+            MIGRATIONS[0].apply(cursor)
+            insert_baseline_rows(cursor, goals, records)
+        connection.commit()
+
+
+def check_migrated(
+    db: GoalsDB,
+    goals: list[Goal],
+    records: list[Record],
+):
+    exclude = {"progress", "goal_progress", "goal_progress_rate"}
+    assert [goal.model_dump(exclude=exclude) for goal in db.get_goals()] == [
+        goal.model_dump(exclude=exclude) for goal in goals
+    ]
+
+    for goal in goals:
+        expected = [record for record in records if record.goal_id == goal.id]
+        migrated = db.get_records_for_goal(goal.id)
+        assert [record.model_dump(exclude={"progress"}) for record in migrated] == [
+            record.model_dump(exclude={"progress"}) for record in expected
+        ]
+        assert db.get_goal(goal.id).progress == goal.interval_start_amount + sum(
+            record.amount for record in expected
+        )
+
+    assert db.check_query_plans() == {}
+
+
+@pytest.mark.parametrize("batch_size", [2, 10000])
+def test_migrate_baseline_db(tmp_path, batch_size):
+    path = str(tmp_path / "goals.db")
+    goals = make_goals()
+    records = make_records(goals)
+    create_baseline_db(path, goals, records)
+
+    with closing(sqlite3.connect(path)) as connection:
+        migrate(connection, batch_size=batch_size)
+        assert get_version(connection) == MIGRATIONS[-1].version
+
+    db = GoalsDB(path)
+    try:
+        check_migrated(db, goals, records)
+    finally:
+        db.close()
+
+
+# The backfill runs while the previous release keeps writing in the old
+# format, then the app only finishes the migration
+def test_backfill_while_serving(tmp_path):
+    path = str(tmp_path / "goals.db")
+    goals = make_goals()
+    records = make_records(goals)
+    create_baseline_db(path, goals, records)
+
+    with closing(sqlite3.connect(path)) as connection:
+        assert migrate(connection, batch_size=4, backfill=True) == MIGRATIONS[:3]
+        assert get_version(connection) == 3
+
+        new_goal = make_goals(4)[3]
+        new_records = make_records([new_goal], per_goal=2)
+        moved = records[3]
+        moved.date += timedelta(days=2)
+        moved.amount = 7
+        # Frees the highest rowid the backfill has passed for the next insert
+        deleted = records.pop()
+        with closing(connection.cursor()) as cursor:
+            cursor.execute("DELETE FROM records WHERE id = ?;", [str(deleted.id)])
+            insert_baseline_rows(cursor, [new_goal], new_records)
+            cursor.execute(
+                "UPDATE records SET date = ?, amount = ? WHERE id = ?;",
+                [str(moved.date), moved.amount, str(moved.id)],
+            )
+        connection.commit()
+
+    goals.append(new_goal)
+    records = sorted(records + new_records, key=lambda record: record.date)
+
+    db = GoalsDB(path)
+    try:
+        check_migrated(db, goals, records)
+    finally:
+        db.close()
+
+    with closing(sqlite3.connect(path)) as connection:
+        assert get_version(connection) == MIGRATIONS[-1].version
+        assert (
+            connection.execute(
+                "SELECT name FROM sqlite_master WHERE name LIKE '%typed_columns%' "
+                "OR name = 'migration_backfills';"
+            ).fetchall()
+            == []
+        )
+
+
+def test_drop_legacy_columns(tmp_path):
+    path = str(tmp_path / "goals.db")
+    goals = make_goals()
+    records = make_records(goals)
+    create_baseline_db(path, goals, records)
+
+    db = GoalsDB(path)
+    db.close()
+
+    with closing(sqlite3.connect(path)) as connection:
+        connection.execute("PRAGMA foreign_keys = ON")
+        assert sorted(drop_legacy_columns(connection)) == [
+            "goals.bucket_size_seconds_legacy",
+            "goals.created_date_legacy",
+            "goals.interval_length_seconds_legacy",
+            "goals.interval_start_date_legacy",
+            "records.created_date_legacy",
+            "records.date_legacy",
+        ]
+        assert drop_legacy_columns(connection) == []
+
+    db = GoalsDB(path)
+    try:
+        check_migrated(db, goals, records)
+        record = Record(goal_id=goals[0].id, date=START, amount=1)
+        db.create_record(record)
+        assert db.get_record(record.id).model_dump(
+            exclude={"progress"}
+        ) == record.model_dump(exclude={"progress"})
+    finally:
+        db.close()
+
+
+# Counts the virtual machine instructions run by migration 2 in thousands. A
+# subquery per goal would visit goals x records rows before any index exists;
+# a single grouped pass stays well inside a budget linear in records.
+def test_records_amount_is_filled_in_one_pass(tmp_path):
+    path = str(tmp_path / "goals.db")
+    goals = make_goals(1000)
+    records = make_records(goals, per_goal=2)
+    create_baseline_db(path, goals, records)
+
+    steps = 0
+
+    def count_step():
+        nonlocal steps
+        steps += 1
+
+    with closing(sqlite3.connect(path)) as connection:
+        connection.set_progress_handler(count_step, 1000)
+        migrate(connection, migrations=MIGRATIONS[:2])
+        connection.set_progress_handler(None, 0)
+
+        assert steps < len(records)
+        totals = dict(connection.execute("SELECT id, records_amount FROM goals;"))
+        assert totals == {
+            str(goal.id): sum(
+                record.amount for record in records if record.goal_id == goal.id
+            )
+            for goal in goals
+        }
+
+
+def test_migrate_dry_run(tmp_path):
+    path = str(tmp_path / "goals.db")
+    goals = make_goals()
+    create_baseline_db(path, goals, make_records(goals))
+
+    with closing(sqlite3.connect(path)) as connection:
+        assert migrate(connection, dry_run=True) == MIGRATIONS
+        assert get_version(connection) == 0
+        assert "records_amount" not in [
+            row[1] for row in connection.execute("PRAGMA table_info(goals);")
+        ]
@@ -0,0 +1,133 @@
+import sqlite3
+import threading
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from db import GoalsDB
+from exceptions import InvalidRequestException
+from models import Goal, Record
+from pydantic import ValidationError
+from write_queue import WriteQueue
+
+START = datetime(2023, 1, 1, 8, 30, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = GoalsDB(str(tmp_path / "goals.db"))
+    yield db
+    db.close()
+
+
+@pytest.fixture
+def goal(db):
+    goal = Goal(
+        name="Goal",
+        interval_start_date=START,
+        interval_start_amount=0,
+        interval_target_amount=100,
+        interval_length=timedelta(days=30),
+        bucket_size=timedelta(days=1),
+        unit="km",
+        reset=False,
+    )
+    db.create_goal(goal)
+    return goal
+
+
+def make_records(
+    goal: Goal,
+    count: int,
+) -> list[Record]:
+    return [
+        Record(
+            goal_id=goal.id,
+            date=START + timedelta(hours=index),
+            amount=index + 1,
+        )
+        for index in range(count)
+    ]
+
+
+# Records the size of every batch handed to create_records, and holds each
+# batch until released so tests can look at the futures in the meantime
+class SpyDB:
+    def __init__(
+        self,
+        db: GoalsDB,
+        fail_on: frozenset = frozenset(),
+    ) -> None:
+        self.db = db
+        self.fail_on = fail_on
+        self.batches: list[int] = []
+        self.writing = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+
+    def create_records(
+        self,
+        records: list[Record],
+    ):
+        self.batches.append(len(records))
+        self.writing.set()
+        self.release.wait()
+        if any(record.id in self.fail_on for record in records):
+            raise sqlite3.OperationalError("disk I/O error")
+        return self.db.create_records(records)
+
+
+def test_records_are_written_in_batches(db, goal):
+    spy = SpyDB(db)
+    write_queue = WriteQueue(spy, batch_size=4, batch_delay_ms=1000)
+    records = make_records(goal, 10)
+
+    futures = [write_queue.submit(record) for record in records]
+    write_queue.close()
+
+    assert [future.result() for future in futures] == [None] * 10
+    assert spy.batches == [4, 4, 2]
+    assert db.get_goal(goal.id).progress == sum(record.amount for record in records)
+
+
+def test_records_are_acknowledged_after_commit(db, goal):
+    spy = SpyDB(db)
+    spy.release.clear()
+    write_queue = WriteQueue(spy, batch_size=2, batch_delay_ms=1000)
+    records = make_records(goal, 2)
+
+    futures = [write_queue.submit(record) for record in records]
+    assert spy.writing.wait(timeout=5)
+    assert not any(future.done() for future in futures)
+
+    spy.release.set()
+    for record, future in zip(records, futures):
+        future.result(timeout=5)
+        assert db.get_record(record.id).amount == record.amount
+    write_queue.close()
+
+
+def test_bad_record_only_fails_its_own_future(db, goal):
+    records = make_records(goal, 5)
+    missing_goal = Record(goal_id=records[0].id, date=START, amount=1)
+    poison = records[2]
+    spy = SpyDB(db, fail_on=frozenset({poison.id}))
+    write_queue = WriteQueue(spy, batch_size=10, batch_delay_ms=1000)
+
+    futures = [write_queue.submit(record) for record in [*records, missing_goal]]
+    write_queue.close()
+
+    assert spy.batches == [6, 1, 1, 1, 1, 1, 1]
+    with pytest.raises(sqlite3.OperationalError):
+        futures[2].result()
+    with pytest.raises(InvalidRequestException):
+        futures[5].result()
+    for record, future in zip(records, futures):
+        if record is not poison:
+            assert future.result() is None
+            assert db.get_record(record.id).amount == record.amount
+
+
+def test_non_finite_amounts_are_rejected(goal):
+    for amount in [float("nan"), float("inf"), float("-inf")]:
+        with pytest.raises(ValidationError):
+            Record(goal_id=goal.id, date=START, amount=amount)
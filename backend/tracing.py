@@ -0,0 +1,240 @@
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+QUERY_TRACING = os.getenv("GOALS_DB_TRACE", default="false").lower() == "true"
+SLOW_QUERY_MS = float(os.getenv("GOALS_DB_SLOW_QUERY_MS", default="100"))
+
+EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "REPLACE")
+
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+WHITESPACE = re.compile(r"\s+")
+
+
+# The statement with literals replaced by ? and whitespace collapsed, so
+# every run of the same query shares one fingerprint
+def get_fingerprint(sql: str) -> str:
+    return WHITESPACE.sub(" ", LITERALS.sub("?", sql)).strip()
+
+
+def get_bind_count(parameters) -> int:
+    try:
+        return len(parameters)
+    except TypeError:
+        return 0
+
+
+# Totals for the queries run on behalf of one request
+class RequestTrace:
+    def __init__(self) -> None:
+        self.queries = 0
+        self.seconds = 0.0
+        self.rows = 0
+        self._lock = threading.Lock()
+
+    def add(
+        self,
+        seconds: float,
+        rows: int,
+    ):
+        with self._lock:
+            self.queries += 1
+            self.seconds += seconds
+            self.rows += rows
+
+
+# Set by TracingMiddleware. AsyncGoalsDB runs each call in a copy of the
+# caller's context, so queries on its worker threads still find the request.
+current_trace: ContextVar[Optional[RequestTrace]] = ContextVar(
+    "current_trace", default=None
+)
+
+
+class QueryTrace:
+    def __init__(
+        self,
+        sql: str,
+        parameters,
+        many: bool,
+    ) -> None:
+        self.sql = sql
+        self.parameters = parameters
+        self.many = many
+        self.bind_count = 0 if many else get_bind_count(parameters)
+        self.seconds = 0.0
+        self.rows = 0
+
+
+# A cursor timing every statement, from execute through its last fetch, since
+# SQLite does most of the work of a query while rows are stepped through.
+# A statement is finished by its next execute, its last row or close.
+class TracingCursor(sqlite3.Cursor):
+    trace: Optional[QueryTrace] = None
+
+    def start(
+        self,
+        sql: str,
+        parameters,
+        many: bool,
+    ):
+        self.finish()
+        self.trace = QueryTrace(sql, parameters, many)
+
+    def timed(self, trace: QueryTrace, method, *args):
+        start = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            trace.seconds += time.perf_counter() - start
+
+    def execute(self, sql, parameters=()):
+        self.start(sql, parameters, many=False)
+        self.timed(self.trace, super().execute, sql, parameters)
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        self.start(sql, None, many=True)
+        self.timed(self.trace, super().executemany, sql, seq_of_parameters)
+        self.finish()
+        return self
+
+    def __next__(self):
+        trace = self.trace
+        if trace is None:
+            return super().__next__()
+        try:
+            row = self.timed(trace, super().__next__)
+        except StopIteration:
+            self.finish()
+            raise
+        trace.rows += 1
+        return row
+
+    def fetchone(self):
+        trace = self.trace
+        if trace is None:
+            return super().fetchone()
+        row = self.timed(trace, super().fetchone)
+        if row is None:
+            self.finish()
+        else:
+            trace.rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        trace = self.trace
+        if trace is None:
+            return super().fetchmany(size if size is not None else self.arraysize)
+        rows = self.timed(
+            trace, super().fetchmany, size if size is not None else self.arraysize
+        )
+        trace.rows += len(rows)
+        if not rows:
+            self.finish()
+        return rows
+
+    def fetchall(self):
+        trace = self.trace
+        if trace is None:
+            return super().fetchall()
+        rows = self.timed(trace, super().fetchall)
+        trace.rows += len(rows)
+        self.finish()
+        return rows
+
+    def close(self):
+        self.finish()
+        super().close()
+
+    def finish(self):
+        trace, self.trace = self.trace, None
+        if trace is None:
+            return
+
+        rows = trace.rows or max(self.rowcount, 0)
+        request = current_trace.get()
+        if request is not None:
+            request.add(trace.seconds, rows)
+
+        if trace.seconds * 1000 >= SLOW_QUERY_MS:
+            log_slow_query(self.connection, trace, rows)
+
+
+def explain(
+    connection: sqlite3.Connection,
+    trace: QueryTrace,
+) -> str:
+    if trace.many or not trace.sql.lstrip().upper().startswith(EXPLAINABLE):
+        return ""
+
+    # A plain cursor so that explaining is not traced itself
+    cursor = sqlite3.Cursor(connection)
+    try:
+        cursor.execute(f"EXPLAIN QUERY PLAN {trace.sql}", trace.parameters)
+        return "; ".join(str(row[3]) for row in cursor.fetchall())
+    except sqlite3.Error as error:
+        return f"unavailable ({error})"
+    finally:
+        cursor.close()
+
+
+def log_slow_query(
+    connection: sqlite3.Connection,
+    trace: QueryTrace,
+    rows: int,
+):
+    fingerprint = get_fingerprint(trace.sql)
+    logging.warning(
+        "Slow query %s took %.1fms (%d binds, %d rows): %s plan: %s",
+        hashlib.sha1(fingerprint.encode()).hexdigest()[:8],
+        trace.seconds * 1000,
+        trace.bind_count,
+        rows,
+        fingerprint,
+        explain(connection, trace),
+    )
+
+
+class TracingConnection(sqlite3.Connection):
+    def cursor(self, factory=TracingCursor):
+        return super().cursor(factory)
+
+
+# Answers each request with a Server-Timing header summing the queries it ran
+class TracingMiddleware:
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace = RequestTrace()
+        token = current_trace.set(trace)
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append(
+                    (
+                        b"server-timing",
+                        (
+                            f'db;dur={trace.seconds * 1000:.3f};desc="{trace.queries} '
+                            f'queries, {trace.rows} rows"'
+                        ).encode(),
+                    )
+                )
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_trace.reset(token)
@@ -0,0 +1,139 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Optional
+
+from db import GoalsDB
+from exceptions import InvalidRequestException
+from models import Record
+
+WRITE_BEHIND = os.getenv("GOALS_DB_WRITE_BEHIND", default="false").lower() == "true"
+WRITE_BATCH_SIZE = int(os.getenv("GOALS_DB_WRITE_BATCH_SIZE", default="500"))
+WRITE_BATCH_DELAY_MS = float(os.getenv("GOALS_DB_WRITE_BATCH_DELAY_MS", default="5"))
+
+
+class WriteQueueClosedException(Exception):
+    def __init__(self, message="Write queue is closed"):
+        self.message = message
+        super().__init__(self.message)
+
+    def __str__(self):
+        return f"WriteQueueClosedException: {self.message}"
+
+
+# Group commit for record inserts. Records submitted from any thread are
+# collected by a single writer thread and inserted with create_records, one
+# transaction per batch. A batch is written once it holds batch_size records
+# or batch_delay_ms after its first record arrived, whichever comes first.
+# When a batch fails as a whole, its records are written again one per
+# transaction, so a bad record only fails its own future.
+#
+# Each submit returns a future that is only resolved once the transaction
+# holding its record has committed, so callers acknowledging on the future
+# keep the same durability as a direct insert.
+class WriteQueue:
+    def __init__(
+        self,
+        db: GoalsDB,
+        batch_size: int = WRITE_BATCH_SIZE,
+        batch_delay_ms: float = WRITE_BATCH_DELAY_MS,
+    ) -> None:
+        if batch_size < 1:
+            raise ValueError(f"Batch size must be at least 1, got {batch_size}")
+
+        self.db = db
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay_ms / 1000
+
+        self._pending: queue.SimpleQueue[
+            Optional[tuple[Record, Future]]
+        ] = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._writer = threading.Thread(
+            target=self.run,
+            name="goals-db-writer",
+            daemon=True,
+        )
+        self._writer.start()
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def submit(
+        self,
+        record: Record,
+    ) -> Future:
+        future: Future = Future()
+        with self._lock:
+            if self._closed:
+                raise WriteQueueClosedException()
+            self._pending.put((record, future))
+        return future
+
+    def next_batch(self) -> tuple[list[tuple[Record, Future]], bool]:
+        item = self._pending.get()
+        if item is None:
+            return [], True
+
+        batch = [item]
+        deadline = time.monotonic() + self.batch_delay
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                item = (
+                    self._pending.get(timeout=timeout)
+                    if timeout > 0
+                    else self._pending.get_nowait()
+                )
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+
+        return batch, False
+
+    def write_batch(
+        self,
+        batch: list[tuple[Record, Future]],
+    ):
+        try:
+            results = self.db.create_records(
+                records=[record for record, _ in batch],
+            )
+        except Exception as error:
+            if len(batch) == 1:
+                batch[0][1].set_exception(error)
+                return
+            # The whole transaction was rolled back, so write the records
+            # one by one and fail only the ones that fail on their own
+            for item in batch:
+                self.write_batch([item])
+            return
+
+        for (_, future), result in zip(batch, results):
+            if result.created:
+                future.set_result(None)
+            else:
+                future.set_exception(InvalidRequestException(message=result.error))
+
+    def run(self):
+        stopped = False
+        while not stopped:
+            batch, stopped = self.next_batch()
+            if batch:
+                self.write_batch(batch)
+
+    # Stops accepting records and waits for everything already submitted to
+    # be written
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._pending.put(None)
+        self._writer.join()
@@ -65,22 +65,14 @@ export const urls: RouteObject[] = [
         element: <GoalsPage />,
         async loader() {
           const completeNavigationProgress = startNavigationProgress();
-          const goals = await goalsApi.getGoals();
-          const goalRecords = await Promise.all(
-            goals.map((goal) =>
-              (async () => ({
-                goal,
-                records: await goalsApi.getGoalRecords({ goalId: goal.id! }),
-              }))()
-            )
-          ).then((r) =>
-            r.reduce(
-              (acc, cur) => ({
-                ...acc,
-                [cur.goal.id!]: cur.records,
-              }),
-              {}
-            )
+          const goalsWithRecords = await goalsApi.getGoalsWithRecords();
+          const goals = goalsWithRecords.map(({ goal }) => goal);
+          const goalRecords = goalsWithRecords.reduce(
+            (acc, cur) => ({
+              ...acc,
+              [cur.goal.id!]: cur.records,
+            }),
+            {}
           );
           completeNavigationProgress();
           return [goals, goalRecords];